@@ -83,7 +83,7 @@ def processBirth(d):
     witnesses = getWitnesses(d)
     rowCommon = commonFields(d, d["child's given name"] + " " + d["child's surname"])
     return [
-        {**rowCommon, **p.normalizedFields()}
+        p.normalizedFields(rowCommon)
         for p in (
             child,
             father,
@@ -64,8 +64,10 @@ def processDeath(d):
     )
 
     if deceased.gender and deceased.gender == spouse.gender:
-        warning("Deceased and spouse have same {} gender: {} and {}".format(
-            deceased.gender, deceasedGiven, spouseGiven))
+        warning(
+            "Deceased and spouse have same {} gender: {} and {}".format(
+                deceased.gender, deceasedGiven, spouseGiven),
+            "same gender spouses")
 
     deceased.deathDate = formatJulianAsGregorian(d["y"], d["m"], d["d"])
     deceased.deathYear = d["y"]
@@ -121,10 +123,7 @@ def processDeath(d):
     spouseFather.role = "Spouse's Father"
 
     rowCommon = commonFields(d, deceased.formatName(False))
-    return [{
-        **rowCommon,
-        **p.normalizedFields()
-    } for p in (
+    return [p.normalizedFields(rowCommon) for p in (
         deceased,
         father,
         fathersFather,
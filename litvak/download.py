@@ -1,46 +1,390 @@
 #!/usr/bin/env python3
 
+import codecs
+import json
 import os
 import re
+import threading
+import time
+from html.parser import HTMLParser
+from itertools import chain
 
-from bs4 import BeautifulSoup
-
-from .utils import get, info
+from .utils import (fileHash, getStream, head, info, warning,
+                    writeFileAtomic)
 
 _xlsRe = re.compile(
     r"/addons/photodownload[.]cfm[?]filename=([^&]+)&location=(\d+)&var=(\d+)")
 
 
-def getFileList(group):
-    info("Scanning for site files: {}".format(group))
-    fileList = {}
-    response = get("site/" + group)
-    soup = BeautifulSoup(response.content, "html.parser")
-    for link in soup.find_all("a", {"class": "excel"}):
-        match = _xlsRe.search(link["onclick"])
+#
+# The group page's spreadsheet links are found as the page streams in (with
+# an incremental HTML tokenizer), rather than by building a tree of the
+# whole page: they are the <a class="excel"> links with a download URL in
+# their onclick attribute.
+#
+class _ExcelLinks(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.fileList = {}
+
+    def handle_starttag(self, tag, attrs):
+        if tag != "a":
+            return
+        attrs = dict(attrs)
+        if "excel" not in (attrs.get("class") or "").split():
+            return
+        match = _xlsRe.search(attrs.get("onclick") or "")
         if not match:
-            continue
+            return
         basename, location, var = match.groups()
-        fileList[basename] = {
+        self.fileList[basename] = {
             "filename": basename,
             "location": location,
             "var": var
         }
+
+
+#
+# The page's encoding, when the server doesn't give one (requests would then
+# assume ISO-8859-1 for any text/html): a byte order mark, or a <meta> charset
+# in the first _SNIFF_SIZE bytes of the page, as a browser would find it,
+# and otherwise UTF-8.
+#
+_SNIFF_SIZE = 1024
+_metaCharsetRe = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?([-\w.:]+)""",
+                            re.IGNORECASE)
+_headerCharsetRe = re.compile(r"""charset\s*=\s*["']?([-\w.:]+)""",
+                              re.IGNORECASE)
+
+
+# The codec's name, or None if there is no such codec.
+def _codecName(encoding):
+    try:
+        return codecs.lookup(encoding).name
+    except LookupError:
+        return None
+
+
+def _sniffEncoding(head):
+    if head.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    match = _metaCharsetRe.search(head)
+    if match:
+        return _codecName(match.group(1).decode("ascii")) or "utf-8"
+    return "utf-8"
+
+
+# The charset of a response, if its Content-Type gives one.
+def _headerCharset(headers):
+    match = _headerCharsetRe.search(headers.get("Content-Type", ""))
+    return _codecName(match.group(1)) if match else None
+
+
+# The file list from the chunks (bytes) of a group page, in the given
+# encoding, or the one the page declares.
+def fileListFromPage(chunks, encoding=None):
+    if not encoding:
+        chunks = iter(chunks)
+        head = b""
+        for chunk in chunks:
+            head += chunk
+            if len(head) >= _SNIFF_SIZE:
+                break
+        encoding = _sniffEncoding(head[:_SNIFF_SIZE])
+        chunks = chain([head], chunks)
+    parser = _ExcelLinks()
+    decoder = codecs.getincrementaldecoder(encoding)("replace")
+    for chunk in chunks:
+        parser.feed(decoder.decode(chunk))
+    parser.feed(decoder.decode(b"", final=True))
+    parser.close()
+    return parser.fileList
+
+
+PAGE_CHUNK_SIZE = 1 << 16
+
+
+def getFileList(group):
+    info("Scanning for site files: {}".format(group))
+    with getStream("site/" + group) as response:
+        fileList = fileListFromPage(response.iter_content(PAGE_CHUNK_SIZE),
+                                    _headerCharset(response.headers))
     info("Found {} files".format(len(fileList)))
     return fileList
 
 
-def downloadXlsFile(outdir, group, params, overwrite, dryrun):
+#
+# A group's file list is cached in the output directory, so that dry runs and
+# downloads of a few files don't have to fetch (and parse) the group's page
+# every time.
+#
+def _fileListPath(cacheDir, group):
+    return os.path.join(cacheDir,
+                        ".files-{}.json".format(re.sub(r"\W+", "-", group)))
+
+
+# The cached file list of a group, if it is at most ttl seconds old.
+def cachedFileList(cacheDir, group, ttl):
+    try:
+        with open(_fileListPath(cacheDir, group)) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    age = time.time() - cached.get("fetched", 0)
+    if not 0 <= age <= ttl:
+        return None
+    fileList = cached["files"]
+    info("Using the file list of {} from {:.1f} hours ago ({} files)".format(
+        group, age / 3600, len(fileList)))
+    return fileList
+
+
+def saveFileList(cacheDir, group, fileList):
+    os.makedirs(cacheDir, exist_ok=True)
+    listing = {"group": group, "fetched": time.time(), "files": fileList}
+    writeFileAtomic(_fileListPath(cacheDir, group),
+                    json.dumps(listing, indent=1).encode())
+
+
+# Downloads are read in large chunks, so the time per chunk doesn't matter.
+CHUNK_SIZE = 1 << 20
+
+# (connect, read) timeouts in seconds: how long to wait for the server to
+# accept a connection, and then between bytes, before giving up.
+DOWNLOAD_TIMEOUT = (30, 60)
+
+
+#
+# A manifest of the spreadsheets downloaded to a directory, so that they can
+# be refreshed without downloading them all again.  For each it records the
+# site's location and var parameters, its size and content hash, and the
+# ETag and Last-Modified validators the server sent with it (if any).
+#
+class DownloadManifest:
+    def __init__(self, outdir):
+        self.path = os.path.join(outdir, ".downloads.json")
+        self.files = {}
+        self.unchanged = 0
+        self.saved = 0  # bytes not downloaded because they were unchanged
+        self.lock = threading.Lock()  # for download threads
+        try:
+            with open(self.path) as f:
+                self.files = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def get(self, baseName):
+        return self.files.get(baseName)
+
+    # Record a downloaded file, given the response headers.
+    def record(self, fileName, params, headers):
+        entry = {
+            "location": params["location"],
+            "var": params["var"],
+            "size": os.path.getsize(fileName),
+            "hash": fileHash(fileName),
+            "etag": headers.get("ETag"),
+            "lastModified": headers.get("Last-Modified"),
+        }
+        with self.lock:
+            self.files[params["filename"]] = entry
+            writeFileAtomic(
+                self.path,
+                json.dumps(self.files, indent=1, sort_keys=True).encode())
+
+    def unchangedFile(self, size):
+        with self.lock:
+            self.unchanged += 1
+            self.saved += size
+
+
+# Is the file still the one the manifest entry records, at the same place
+# on the site?
+def _isRecorded(fileName, params, entry):
+    return (entry["location"] == params["location"]
+            and entry["var"] == params["var"]
+            and os.path.getsize(fileName) == entry["size"]
+            and fileHash(fileName) == entry["hash"])
+
+
+#
+# Download a spreadsheet, returning the number of bytes downloaded.
+#
+# It is downloaded to a .part file, which is only renamed to the file name
+# once it is complete (and synced to disk), so an interrupted download never
+# leaves a truncated spreadsheet.  The next download of the file resumes the
+# .part file with a Range request, if the server supports that, and
+# otherwise starts it again.  The validator (ETag or Last-Modified) the
+# server sent when the .part file was started is kept next to it, and sent
+# as If-Range, so that if the file has changed on the site since, it is
+# sent whole rather than spliced onto the old version.  A .part file without
+# a validator is not resumed.
+#
+# With refresh, an existing file is downloaded again only if it has changed:
+# a conditional request tells if the server has sent validators for it,
+# and otherwise a HEAD request, if it is still the same size.
+#
+def downloadXlsFile(outdir,
+                    group,
+                    params,
+                    overwrite,
+                    dryrun,
+                    manifest=None,
+                    refresh=False):
     fileName = os.path.join(outdir, params["filename"])
     os.makedirs(outdir, exist_ok=True)
-    if os.path.exists(fileName) and not overwrite:
+    exists = os.path.exists(fileName)
+    if exists and not overwrite and not refresh:
         info("File exists - skipping: {}".format(fileName))
-        return
+        return 0
     if dryrun:
-        info("Dry run - would download: {}".format(fileName))
-        return
-    info("Saving {}...".format(fileName))
-    stream = get("addons/photodownload.cfm", stream=True, params=params)
-    with open(fileName, "wb") as f:
-        for chunk in stream.iter_content(1024):
-            f.write(chunk)
+        info("Dry run - would {}: {}".format(
+            "refresh" if exists and not overwrite else "download", fileName))
+        return 0
+    partName = fileName + ".part"
+    offset = os.path.getsize(partName) if os.path.exists(partName) else 0
+    ifRange = _partValidator(partName, params) if offset else None
+    if offset and not ifRange:
+        info("Can't resume (no validator) - restarting: {}".format(fileName))
+        offset = 0
+
+    conditional = {}
+    if exists and not overwrite and not offset:
+        entry = manifest.get(params["filename"]) if manifest else None
+        if entry and not _isRecorded(fileName, params, entry):
+            pass  # changed here, or moved on the site: download it
+        elif entry and (entry["etag"] or entry["lastModified"]):
+            if entry["etag"]:
+                conditional["If-None-Match"] = entry["etag"]
+            if entry["lastModified"]:
+                conditional["If-Modified-Since"] = entry["lastModified"]
+        else:
+            response = head("addons/photodownload.cfm", params=params)
+            size = os.path.getsize(fileName)
+            if response.headers.get("Content-Length") == str(size):
+                info("Same size - skipping: {}".format(fileName))
+                if manifest:
+                    manifest.record(fileName, params, response.headers)
+                    manifest.unchangedFile(size)
+                return 0
+
+    if offset:
+        info("Resuming {} at {} bytes...".format(fileName, offset))
+        try:
+            status, size, headers = _download(partName, params, offset,
+                                              {"If-Range": ifRange})
+        except ValueError:
+            # e.g. 416: the server can't resume it
+            info("Can't resume - restarting: {}".format(fileName))
+            offset = 0
+    if not offset:
+        info("{} {}...".format("Refreshing" if conditional else "Saving",
+                               fileName))
+        status, size, headers = _download(partName, params, 0, conditional)
+    if status == 304:
+        info("Not modified: {}".format(fileName))
+        if manifest:
+            manifest.unchangedFile(os.path.getsize(fileName))
+        return 0
+    if size is None:
+        warning("Incomplete download, to be resumed: {}".format(fileName),
+                "incomplete download")
+        return 0
+    os.replace(partName, fileName)
+    _removeValidator(partName)
+    if manifest:
+        manifest.record(fileName, params, headers)
+    return size
+
+
+#
+# The validator of a .part file is kept in a .part.json file next to it,
+# with the location and var it was downloaded from.
+#
+def _validatorPath(partName):
+    return partName + ".json"
+
+
+def _saveValidator(partName, params, headers):
+    etag = headers.get("ETag")
+    validator = {
+        "location": params["location"],
+        "var": params["var"],
+        # If-Range needs a strong ETag
+        "etag": etag if etag and not etag.startswith("W/") else None,
+        "lastModified": headers.get("Last-Modified"),
+    }
+    writeFileAtomic(_validatorPath(partName),
+                    json.dumps(validator, indent=1).encode())
+
+
+# The If-Range value with which to resume a .part file, or None if it can't
+# be resumed safely.
+def _partValidator(partName, params):
+    try:
+        with open(_validatorPath(partName)) as f:
+            validator = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (validator.get("location") != params["location"]
+            or validator.get("var") != params["var"]):
+        return None
+    return validator.get("etag") or validator.get("lastModified")
+
+
+def _removeValidator(partName):
+    try:
+        os.remove(_validatorPath(partName))
+    except OSError:
+        pass
+
+
+# Download to (the end of) a .part file, returning the response status, the
+# number of bytes read (None if the connection was closed before all of them
+# were sent), and the response headers.  If the server sends the whole file
+# instead of the rest of it (e.g. because it has changed), the .part file is
+# started again.
+def _download(partName, params, offset, headers=None):
+    # loaded by login(), before any download
+    from requests.exceptions import RequestException
+
+    headers = dict(headers or {})
+    if offset:
+        headers["Range"] = "bytes={}-".format(offset)
+    try:
+        with getStream("addons/photodownload.cfm",
+                       params=params,
+                       headers=headers,
+                       timeout=DOWNLOAD_TIMEOUT) as stream:
+            if stream.status_code == 304:
+                return 304, 0, stream.headers
+            resumed = (stream.status_code == 206 and stream.headers.get(
+                "Content-Range", "").startswith("bytes {}-".format(offset)))
+            if offset and not resumed and stream.status_code == 206:
+                raise ValueError("Range not honored")
+            # the body's length, if it isn't compressed
+            length = None
+            if "Content-Encoding" not in stream.headers:
+                length = int(stream.headers.get("Content-Length", -1))
+            if offset and not resumed:
+                info("Changed on the site, or can't resume - restarting: "
+                     "{}".format(partName[:-len(".part")]))
+            if not resumed:
+                _saveValidator(partName, params, stream.headers)
+            size = 0
+            with open(partName, "ab" if resumed else "wb") as f:
+                try:
+                    for chunk in stream.iter_content(CHUNK_SIZE):
+                        f.write(chunk)
+                        size += len(chunk)
+                finally:
+                    # keep what we have, to resume from
+                    f.flush()
+                    os.fsync(f.fileno())
+    except RequestException as e:
+        # e.g. the connection was reset, or timed out
+        info("Download failed: {}: {}".format(partName[:-len(".part")], e))
+        return None, None, {}
+    if length is not None and 0 <= size < length:
+        size = None
+    return stream.status_code, size, stream.headers
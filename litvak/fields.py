@@ -0,0 +1,51 @@
+#
+# The output fields.  These are kept apart from the normalizer, so the
+# scripts can list them (e.g. in --help) without loading the name lexicon.
+#
+
+# output field, and description
+fieldInfo = (
+    ("File", "The name of the source spreadsheet for this record"),
+    ("Row", "The spreadsheet row number on which this record appears."),
+    ("Source Description", "A brief description that identifies the record."),
+    ("Name", "The normalized name of an individual mentioned in a record."),
+    ("Gender", "Male, Female, or Unknown. An educated"
+     " guess based on role and name."),
+    ("Role", "The role of the individual with respect to this record."),
+    ("Birth Date",
+     "The date of birth. Gregorian calendar. May be approximate."),
+    (
+        "Birth Note",
+        "If approximate, how it was derived (e.g. from age, "
+        "or relation to child or spouse)",
+    ),
+    ("Birth Place", "The town, district, province of the birth."),
+    ("Death Date", "The date of death. Gregorian calendar."),
+    (
+        "Death Note",
+        "If approximate, how it was derived"
+        " (e.g. from age, or relation to spouse)",
+    ),
+    ("Death Place", "The town, district, province of the death."),
+    ("Marriage Date", "The date of marriage. Gregorian calendar."),
+    ("Marriage Place", "The town, district, province of the marriage."),
+    ("Source",
+     "As indicated on the spreadsheet, typically archive/fond/list/item"),
+    ("Microfilm", "As indicated on the spreadsheet"),
+    ("Recorded On", "Year recorded, in source spreadsheet."),
+    ("Recorded At", "Place recorded, in source spreadsheet."),
+    ("Record Number", "Record number in source spreadsheet."),
+    ("Source Given Name", "The raw given name from the source record."),
+    ("Source Surname", "The raw surname from the source record."),
+    (
+        "Source Date",
+        "The event date as it is in the source record, Julian Day/Month/Year.",
+    ),
+    (
+        "Source Place",
+        "The event place as it is in the source record, Town, Uyezd, Gubernia",
+    ),
+    ("Errors", "Warnings raised while normalizing the record, if any."),
+)
+
+fieldNames = tuple(x[0] for x in fieldInfo)
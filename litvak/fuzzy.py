@@ -0,0 +1,63 @@
+#
+# Nearest spellings by edit distance, for names that are near misses of
+# ones in the name list (typos like Abrahma, Chajm).
+#
+# If two words are within edit distance k, deleting at most k letters from
+# each gives the same string.  So the index maps every string made by
+# deleting up to k letters of a word (including none) to the words it came
+# from: the candidates for a query are the words under its own deletions,
+# a few dictionary lookups, and only they are compared to it.
+# Ref: https://wolfgarbe.medium.com/1000x-faster-spelling-correction-algorithm-2012-8701fcd87a5f
+#
+
+
+# Levenshtein distance: the number of single letter insertions, deletions
+# and substitutions that turn a into b.
+def editDistance(a, b):
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(
+                min(previous[j] + 1, current[j - 1] + 1,
+                    previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+# word, and every string made by deleting up to maxDistance of its letters
+def _deletions(word, maxDistance):
+    deletions = {word}
+    shorter = {word}
+    for i in range(maxDistance):
+        shorter = {w[:j] + w[j + 1:] for w in shorter for j in range(len(w))}
+        deletions |= shorter
+    return deletions
+
+
+class SpellingIndex:
+    def __init__(self, words, maxDistance):
+        self.maxDistance = maxDistance
+        self.words = {}  # deletion: words
+        for word in words:
+            for deletion in _deletions(word, maxDistance):
+                self.words.setdefault(deletion, []).append(word)
+
+    # The (distance, word) of each word within maxDistance (at most the
+    # index's), nearest first.
+    def search(self, word, maxDistance=None):
+        if maxDistance is None or maxDistance > self.maxDistance:
+            maxDistance = self.maxDistance
+        candidates = set()
+        for deletion in _deletions(word, maxDistance):
+            candidates.update(self.words.get(deletion, ()))
+        found = []
+        for candidate in candidates:
+            if abs(len(candidate) - len(word)) <= maxDistance:
+                distance = editDistance(word, candidate)
+                if distance <= maxDistance:
+                    found.append((distance, candidate))
+        found.sort()
+        return found
@@ -0,0 +1,203 @@
+import re
+from collections import defaultdict
+from itertools import chain
+
+from .names import parsedName, parsedNameScore
+from .phonetic import soundex
+from .timing import stage
+from .utils import info
+
+#
+# Link the normalized rows that are (probably) the same person, across
+# records, into clusters.
+#
+# Comparing every pair of rows would take forever, so rows are only compared
+# within blocks of rows with the same surname soundex code, gender and
+# district, and with births in the same or adjacent decades.  A block that
+# is still too big is split by first given name.  A pair is scored by name
+# (as nameScore, with each row's name parsed once), birth year and birth town
+# agreement, and pairs that score at least the threshold are joined, with
+# union-find, into clusters.
+#
+# Pairs are joined one at a time, so a chain of pairs could still join two
+# persons that wouldn't have been: a join is refused if the cluster would
+# then hold two persons of one record (a record mentions each person once),
+# or births more than MAX_YEAR_SPAN years apart.
+#
+MAX_BLOCK = 1000
+THRESHOLD = 0.7
+MAX_YEAR_SPAN = 15
+
+linkFields = ("File", "Row", "Name", "Gender", "Birth Date", "Birth Note",
+              "Birth Place", "Source Place")
+
+_yearRe = re.compile(r"\b(\d{4})\b")
+
+
+class _Person:
+    __slots__ = ("name", "parsed", "record", "year", "estimated", "town")
+
+    def __init__(self, name, record, year, estimated, town):
+        self.name = name
+        try:
+            self.parsed = parsedName(name)
+        except ValueError:
+            self.parsed = None  # never linked
+        self.record = record
+        self.year = year
+        self.estimated = estimated
+        self.town = town
+
+
+def _part(place, i):
+    parts = place.split(",") if place else ()
+    return parts[i].strip() if len(parts) > i else ""
+
+
+def _birthYear(row):
+    match = _yearRe.search(row["Birth Date"] or "")
+    return int(match.group(1)) if match else None
+
+
+# The blocks of a row, without the decade: none if it has no surname.
+def _blockKeys(row):
+    surname = row["Name"].rpartition("/")[0].rpartition("/")[2]
+    if not surname:
+        return ()
+    return [(code, row["Gender"], _part(row["Source Place"], 1))
+            for code in sorted(soundex(surname))]
+
+
+def _dateScore(p1, p2):
+    difference = abs(p1.year - p2.year)
+    if p1.estimated or p2.estimated:
+        return 0.8 if difference <= 5 else 0.6 if difference <= 10 else 0
+    return 1 if difference <= 1 else 0.8 if difference <= 3 else 0
+
+
+def _placeScore(p1, p2):
+    if not p1.town or not p2.town:
+        return 0.9
+    return 1 if p1.town == p2.town else 0.6
+
+
+def pairScore(p1, p2):
+    if p1.record == p2.record:
+        return 0  # a record mentions each person once
+    score = _dateScore(p1, p2) * _placeScore(p1, p2)
+    if not score:
+        return 0
+    if p1.name == p2.name:
+        return score
+    return score * parsedNameScore(p1.parsed, p2.parsed)
+
+
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+# The records and birth years of a cluster's persons.
+class _Cluster:
+    __slots__ = ("records", "first", "last")
+
+    def __init__(self, person):
+        self.records = {person.record}
+        self.first = self.last = person.year
+
+
+def _cluster(clusters, persons, root):
+    cluster = clusters.get(root)
+    if cluster is None:
+        cluster = clusters[root] = _Cluster(persons[root])
+    return cluster
+
+
+# Join the clusters of two roots, unless that would break the rules above.
+def _union(parent, clusters, persons, rootI, rootJ):
+    a = _cluster(clusters, persons, rootI)
+    b = _cluster(clusters, persons, rootJ)
+    if (max(a.last, b.last) - min(a.first, b.first) > MAX_YEAR_SPAN
+            or not a.records.isdisjoint(b.records)):
+        return False
+    if len(a.records) < len(b.records):
+        a, b = b, a
+    a.records |= b.records
+    a.first = min(a.first, b.first)
+    a.last = max(a.last, b.last)
+    root, other = min(rootI, rootJ), max(rootI, rootJ)
+    parent[other] = root
+    clusters[root] = a
+    del clusters[other]
+    return True
+
+
+def _firstGiven(person):
+    return person.name.split(" ", 1)[0]
+
+
+def _byGiven(block, persons):
+    byGiven = defaultdict(list)
+    for i in block:
+        byGiven[_firstGiven(persons[i])].append(i)
+    return byGiven
+
+
+#
+# Given the normalized rows (dicts of the output fields, which must include
+# linkFields), return a cluster number for each row, numbered from 1 in
+# order of first appearance.  The rows are only read once, and not kept.
+#
+def linkPersons(rows, threshold=THRESHOLD):
+    persons = []
+    blocks = defaultdict(list)  # (surname code, gender, district, decade)
+    for i, row in enumerate(rows):
+        year = _birthYear(row)
+        persons.append(
+            _Person(row["Name"], (row["File"], row["Row"]), year,
+                    (row["Birth Note"] or "").startswith("Estimated"),
+                    _part(row["Birth Place"], 0)))
+        if year and persons[-1].parsed:
+            for key in _blockKeys(row):
+                blocks[(*key, year // 10)].append(i)
+
+    parent = list(range(len(persons)))
+    joined = {}  # root: _Cluster, of the persons that have been joined
+    compared = 0
+    refused = 0
+    with stage("link persons"):
+        for (code, gender, district, decade), block in blocks.items():
+            # the rows of the block, and of the next decade's
+            nextBlock = blocks.get((code, gender, district, decade + 1), [])
+            parts = [block]
+            if len(block) > MAX_BLOCK:
+                parts = _byGiven(block, persons).values()
+            nextByGiven = None
+            if len(nextBlock) > MAX_BLOCK:
+                nextByGiven = _byGiven(nextBlock, persons)
+            for part in parts:
+                for n, i in enumerate(part):
+                    others = nextBlock
+                    if nextByGiven is not None:
+                        others = nextByGiven.get(_firstGiven(persons[i]), ())
+                    for j in chain(part[n + 1:], others):
+                        rootI, rootJ = _find(parent, i), _find(parent, j)
+                        if rootI == rootJ:
+                            continue
+                        compared += 1
+                        if (pairScore(persons[i], persons[j]) >= threshold
+                                and not _union(parent, joined, persons,
+                                               rootI, rootJ)):
+                            refused += 1
+
+    clusters = {}
+    numbers = []
+    for i in range(len(persons)):
+        numbers.append(clusters.setdefault(_find(parent, i),
+                                           len(clusters) + 1))
+    info("Linked {} rows into {} persons ({} blocks, {} pairs scored, {} "
+         "joins refused)".format(len(persons), len(clusters), len(blocks),
+                                compared, refused))
+    return numbers
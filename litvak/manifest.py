@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import pickle
+
+from .names import fuzzyNames, lexiconVersion, phoneticNames
+from .utils import fileHash, info, writeFileAtomic
+
+#
+# A manifest of normalized spreadsheets, and a cache of their output rows
+# (fragments), so a re-run only has to normalize new or changed files.
+#
+# A fragment is only valid for the lexicon and normalizer code that produced
+# it, so the manifest records a version hash of each (and the fuzzy name
+# distance, and whether names are matched by sound): when any changes, every
+# fragment is discarded.
+#
+
+# the modules whose code determines the output rows
+_normalizerModules = (
+    "birth",
+    "death",
+    "fields",
+    "fuzzy",
+    "marriage",
+    "names",
+    "normalize",
+    "parsexls",
+    "person",
+    "phonetic",
+    "process",
+    "utils",  # the Errors field
+)
+
+
+def codeVersion():
+    h = hashlib.sha256()
+    moduleDir = os.path.dirname(__file__)
+    for module in _normalizerModules:
+        with open(os.path.join(moduleDir, module + ".py"), "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+class Manifest:
+    def __init__(self, cacheDir):
+        self.cacheDir = cacheDir
+        self.path = os.path.join(cacheDir, "manifest.json")
+        self.version = {
+            "lexicon": lexiconVersion(),
+            "code": codeVersion(),
+            "fuzzy": fuzzyNames(),
+            "phonetic": phoneticNames(),
+        }
+        self.files = {}
+        self._hashes = {}
+        os.makedirs(cacheDir, exist_ok=True)
+        try:
+            with open(self.path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return
+        if manifest.get("version") == self.version:
+            self.files = manifest.get("files", {})
+        else:
+            info("Lexicon or normalizer changed, discarding cached results.",
+                 "cache")
+
+    def _hash(self, fileName):
+        key = os.path.abspath(fileName)
+        if key not in self._hashes:
+            self._hashes[key] = fileHash(fileName)
+        return self._hashes[key]
+
+    def _fragmentPath(self, entry):
+        return os.path.join(self.cacheDir, entry["fragment"])
+
+    # Does the cache hold the output of this version of the file?
+    def isCurrent(self, fileName):
+        entry = self.files.get(os.path.abspath(fileName))
+        if not entry or not os.path.exists(self._fragmentPath(entry)):
+            return False
+        st = os.stat(fileName)
+        if st.st_size != entry["size"]:
+            return False
+        if st.st_mtime_ns == entry["mtime"]:
+            return True
+        # touched, but maybe not changed
+        if self._hash(fileName) != entry["hash"]:
+            return False
+        entry["mtime"] = st.st_mtime_ns
+        return True
+
+    def rows(self, fileName):
+        entry = self.files[os.path.abspath(fileName)]
+        with open(self._fragmentPath(entry), "rb") as f:
+            return pickle.load(f)
+
+    def store(self, fileName, fileType, records, rows):
+        st = os.stat(fileName)
+        contentHash = self._hash(fileName)
+        fragment = hashlib.sha256(
+            (contentHash + os.path.basename(fileName)).encode()).hexdigest()
+        entry = {
+            "hash": contentHash,
+            "size": st.st_size,
+            "mtime": st.st_mtime_ns,
+            "fileType": fileType,
+            "records": records,
+            "rows": len(rows),
+            "fragment": fragment + ".pickle",
+        }
+        writeFileAtomic(self._fragmentPath(entry),
+                        pickle.dumps(rows, pickle.HIGHEST_PROTOCOL))
+        self.files[os.path.abspath(fileName)] = entry
+
+    # Write the manifest, and remove fragments that are no longer used.
+    def save(self):
+        writeFileAtomic(
+            self.path,
+            json.dumps(
+                {
+                    "version": self.version,
+                    "files": self.files
+                },
+                indent=1,
+                sort_keys=True,
+            ).encode(),
+        )
+        used = {entry["fragment"] for entry in self.files.values()}
+        for name in os.listdir(self.cacheDir):
+            if name.endswith(".pickle") and name not in used:
+                os.remove(os.path.join(self.cacheDir, name))
@@ -67,10 +67,7 @@ def processMarriage(d):
                                d["wife's given name"], d["wife's surname"]),
     )
 
-    return [{
-        **rowCommon,
-        **p.normalizedFields()
-    } for p in (
+    return [p.normalizedFields(rowCommon) for p in (
         *husbFam,
         *wifeFam,
         *witnesses,
@@ -8,10 +8,19 @@
 # https://bloodandfrogs.com/2011/06/variations-in-jewish-given-names.html
 # https://www.jewishgen.org/databases/GivenNames/search.htm
 #
+import hashlib
+import heapq
+import os
+import pickle
 import re
+from collections import OrderedDict
+from functools import wraps
+from operator import itemgetter
 
-from .namelist import nameList
-from .utils import fatal, info, warning
+from .fuzzy import SpellingIndex
+from .phonetic import soundex
+from .timing import countCache, timed
+from .utils import debug, fatal, warning, writeFileAtomic
 
 # map raw name (titlecase) to normalized name (uppercase):
 nameMap = {"M": {}, "F": {}, "S": {}, "P": {}}
@@ -19,6 +28,8 @@ genderSet = {"M": set(), "F": set()}
 
 
 def initNameMaps():
+    from .namelist import nameList
+
     for (cooked, gender, rawList) in nameList:
         cooked = cooked.upper()
         gender = gender.upper()
@@ -31,7 +42,148 @@ def initNameMaps():
             nameMap[gender][raw.title()] = cooked
 
 
-initNameMaps()
+#
+# Building the name maps means loading the (large) namelist module and
+# looping over it, so CompileNameList saves the finished maps in a pickle,
+# with the hash of namelist.py they were built from.  At import the maps are
+# loaded from it, unless it is missing or out of date.
+#
+_LEXICON = os.path.join(os.path.dirname(__file__), "namelist.py")
+LEXICON_CACHE = os.path.join(os.path.dirname(__file__), "namemaps.pickle")
+_LEXICON_CACHE_VERSION = 1
+
+
+def lexiconVersion():
+    with open(_LEXICON, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _loadNameMaps():
+    try:
+        with open(LEXICON_CACHE, "rb") as f:
+            cached = pickle.load(f)
+        if (cached["cacheVersion"] != _LEXICON_CACHE_VERSION
+                or cached["lexicon"] != lexiconVersion()):
+            return False
+        maps = cached["nameMap"], cached["genderSet"]
+    except (OSError, pickle.UnpicklingError, EOFError, KeyError, TypeError):
+        return False
+    for table, loaded in zip((nameMap, genderSet), maps):
+        for gender in table:
+            table[gender] = loaded[gender]
+    return True
+
+
+# Check the name list, and save the name maps built from it.  Returns the
+# number of problems found (the maps are saved anyway).
+def compileNameMaps():
+    from .namelist import nameList
+
+    problems = 0
+    seen = {}
+    for entry in nameList:
+        if len(entry) != 3 or not isinstance(entry[2], tuple):
+            fatal("Malformed namelist entry: {}".format(entry))
+        cooked, gender, rawList = entry
+        if gender.upper() not in nameMap:
+            warning("{} has unknown gender {}".format(cooked, gender),
+                    "namelist")
+            problems += 1
+            continue
+        for raw in (cooked, *rawList):
+            key = (gender.upper(), raw.title())
+            other = seen.setdefault(key, cooked.upper())
+            if other != cooked.upper():
+                warning(
+                    "{} ({}) is a spelling of both {} and {}".format(
+                        raw, gender, other, cooked.upper()), "namelist")
+                problems += 1
+    for table in (nameMap, genderSet):
+        for gender in table:
+            table[gender] = type(table[gender])()
+    initNameMaps()
+    clearNameCaches()
+    writeFileAtomic(
+        LEXICON_CACHE,
+        pickle.dumps(
+            {
+                "cacheVersion": _LEXICON_CACHE_VERSION,
+                "lexicon": lexiconVersion(),
+                "nameMap": nameMap,
+                "genderSet": genderSet,
+            },
+            protocol=pickle.HIGHEST_PROTOCOL,
+        ),
+    )
+    return problems
+
+
+if not _loadNameMaps():
+    initNameMaps()
+
+#
+# The same few thousand names come up again and again, so the results of
+# normalizeName and mapRawName are kept in bounded LRU caches.
+#
+# A cached result must give the same warnings as the call it saves, so the
+# warnings raised while computing it are kept with it and raised again on a
+# hit.  Warnings go through _warning, which records them for every cached
+# call in progress (these nest: normalizeName calls mapRawName).
+#
+CACHE_SIZE = 100000
+
+_capturing = []
+
+
+def _warning(msg, category):
+    if _capturing:
+        _capturing[-1].append((msg, category))
+    warning(msg, category)
+
+
+def memoized(name, maxSize=CACHE_SIZE):
+    def decorate(fn):
+        cache = OrderedDict()
+
+        @wraps(fn)
+        def wrapper(*args):
+            # only names, so e.g. 1 and 1.0 aren't taken as the same key
+            if not all(arg is None or type(arg) is str for arg in args):
+                return fn(*args)
+            entry = cache.get(args)
+            countCache(name, entry is not None)
+            if entry is not None:
+                cache.move_to_end(args)
+                result, warnings = entry
+                for msg, category in warnings:
+                    _warning(msg, category)
+                return result
+            _capturing.append([])
+            try:
+                result = fn(*args)
+            finally:
+                warnings = _capturing.pop()
+            if _capturing:
+                _capturing[-1].extend(warnings)
+            cache[args] = (result, tuple(warnings))
+            if len(cache) > maxSize:
+                cache.popitem(last=False)
+            return result
+
+        wrapper.cache = cache
+        return wrapper
+
+    return decorate
+
+
+def clearNameCaches():
+    global _phoneticIndex, _spellingIndex
+    _cachedNormalizeName.cache.clear()
+    mapRawName.cache.clear()
+    _phoneticIndex = None
+    _spellingIndex = None
+
+
 # extract patronyms ('x son of y', 'x yowicz') from a raw name
 
 # The raw given name might contain a patronym, which we separate out.
@@ -92,6 +244,141 @@ def clean(nameRaw):
     return nameRaw.strip()
 
 
+#
+# In phonetic mode (setPhoneticNames), a given name that isn't in the name
+# list may still be a new spelling of one that is, so if it sounds like
+# exactly one of the names of its gender (by Daitch-Mokotoff soundex), it is
+# mapped to that, with a warning so the row can be checked.  The index of
+# soundex codes is built on first use.
+#
+MIN_PHONETIC_LENGTH = 3
+
+_phonetic = False
+
+# gender: {soundex code: set of normalized names}
+_phoneticIndex = None
+
+
+def setPhoneticNames(on):
+    global _phonetic
+    _phonetic = bool(on)
+    clearNameCaches()
+
+
+def phoneticNames():
+    return _phonetic
+
+
+def _phoneticMatch(name, gender):
+    global _phoneticIndex
+    if _phoneticIndex is None:
+        _phoneticIndex = {}
+        for g in genderSet:
+            index = _phoneticIndex[g] = {}
+            for raw, cooked in nameMap[g].items():
+                for code in soundex(raw):
+                    index.setdefault(code, set()).add(cooked)
+    index = _phoneticIndex[gender]
+    matches = set()
+    for code in soundex(name):
+        matches.update(index.get(code, ()))
+    return matches.pop() if len(matches) == 1 else None
+
+
+#
+# In fuzzy mode (setFuzzyNames), a name that isn't in the name list is
+# mapped to the nearest listed spelling of its gender (or of a surname),
+# within the given edit distance, if the nearest spellings are all of one
+# name.  The index of spellings is built on first use.
+#
+# Short names are within a couple of letters of many others (Segal and
+# Sal), so names shorter than FUZZY_LONG_NAME letters are only matched
+# within one letter change, whatever the distance given.
+#
+MIN_FUZZY_LENGTH = 4
+FUZZY_LONG_NAME = 6
+
+_fuzzyDistance = 0
+
+# gender: SpellingIndex of the spellings in nameMap
+_spellingIndex = None
+
+
+def setFuzzyNames(maxDistance):
+    global _fuzzyDistance
+    _fuzzyDistance = maxDistance
+    clearNameCaches()
+
+
+def fuzzyNames():
+    return _fuzzyDistance
+
+
+# The (distance, normalized name, spelling) of the listed spellings of the
+# gender ("S" for surnames) within maxDistance of a name, nearest first.
+def nearestNames(name, gender, maxDistance):
+    global _spellingIndex
+    if _spellingIndex is None or _spellingIndex["M"].maxDistance < maxDistance:
+        _spellingIndex = {
+            g: SpellingIndex(nameMap[g], maxDistance)
+            for g in ("M", "F", "S")
+        }
+    return [(distance, nameMap[gender][spelling], spelling)
+            for distance, spelling in _spellingIndex[gender].search(
+                name, maxDistance)]
+
+
+def _fuzzyMatch(name, gender):
+    maxDistance = _fuzzyDistance
+    if len(name) < FUZZY_LONG_NAME:
+        maxDistance = min(maxDistance, 1)
+    nearest = nearestNames(name, gender, maxDistance)
+    if not nearest:
+        return None
+    best = {cooked for distance, cooked, spelling in nearest
+            if distance == nearest[0][0]}
+    return best.pop() if len(best) == 1 else None
+
+
+#
+# Only the first name of a string of names is matched by spelling or sound:
+# the rest may be a second given name, but in a witness (e.g. "Simon Levin")
+# or a combined name it is often a surname, which shouldn't become a given
+# name that is spelled or sounds like it.
+#
+def _mapName(name, gender, first=True):
+    cooked = nameMap[gender].get(name)
+    if cooked:
+        return cooked
+    if not first:
+        return name
+    if (_fuzzyDistance and gender != "P" and len(name) >= MIN_FUZZY_LENGTH
+            and name.isalpha()):
+        cooked = _fuzzyMatch(name, gender)
+        if cooked:
+            _warning("{} mapped to {} by spelling".format(name, cooked),
+                     "fuzzy match")
+            return cooked
+    if (_phonetic and gender in genderSet
+            and len(name) >= MIN_PHONETIC_LENGTH and name.isalpha()):
+        cooked = _phoneticMatch(name, gender)
+        if cooked:
+            _warning("{} mapped to {} by sound".format(name, cooked),
+                     "phonetic match")
+            return cooked
+    return name
+
+
+# With guessed, the gender is only a guess, so no name is matched
+# approximately (which could give a name of the wrong gender).
+def _mapNames(subNames, gender, guessed=False):
+    return " ".join([
+        _mapName(name, gender, i == 0 and not guessed)
+        for i, name in enumerate(subNames)
+    ])
+
+
+@memoized("mapRawName")
 def mapRawName(nameRaw, gender=None):
     global nameMap
     # assume patronymics have been removed, and we're left with a string of
@@ -99,10 +386,7 @@ def mapRawName(nameRaw, gender=None):
     # UPPERCASE.  Unmappable names are in Title Case.
     subNames = clean(nameRaw).title().split()
     if gender:
-        return (
-            " ".join([nameMap[gender].get(name, name) for name in subNames]),
-            gender,
-        )
+        return _mapNames(subNames, gender), gender
 
     # maybe one of the subnames tells us the gender of the whole name
     genSet = set()
@@ -118,18 +402,16 @@ def mapRawName(nameRaw, gender=None):
     elif genSet == {"F"}:
         gender = "F"
     elif genSet == {"M", "F"}:
-        warning(
+        _warning(
             "name '{}' has a mix of male-only and female-only names".format(
-                nameRaw))
+                nameRaw), "mixed gender name")
         gender = "M"  # later, fix the name list
+        return _mapNames(subNames, gender, guessed=True), gender
     else:
         # nameList has nothing, or gender is ambiguous
         return nameRaw, None
 
-    return (
-        " ".join([nameMap[gender].get(name, name) for name in subNames]),
-        gender,
-    )
+    return _mapNames(subNames, gender), gender
 
 
 #
@@ -145,8 +427,9 @@ def extractPatronym(gnRaw, pnRaw, gender):
         gn, gmark, pn1, pn2, pn3 = match.groups()
         pn = pn1 or pn2 or pn3
     if pnRaw and pn.upper() != str(pnRaw).upper():
-        warning("Name {} has two patronyms: {} overwrites {}".format(
-            gnRaw, pn, pnRaw))
+        _warning(
+            "Name {} has two patronyms: {} overwrites {}".format(
+                gnRaw, pn, pnRaw), "two patronyms")
     if gmark:
         # update gender based on patronym gender mark: son of, dau of
         gmarkNormalized = gmark[0:3].lower()
@@ -154,19 +437,33 @@ def extractPatronym(gnRaw, pnRaw, gender):
             if not gender or gender == "M":
                 gender = "M"
             elif gender:
-                warning("Name {} has patronym gender: {}, expected {}".format(
-                    gnRaw, gmark, gender))
+                _warning(
+                    "Name {} has patronym gender: {}, expected {}".format(
+                        gnRaw, gmark, gender), "patronym gender")
         elif gmarkNormalized in ("dau", "bat"):
             if not gender or gender == "F":
                 gender = "F"
             elif gender:
-                warning("Name {} has patronym gender: {}, expected {}".format(
-                    gnRaw, gmark, gender))
+                _warning(
+                    "Name {} has patronym gender: {}, expected {}".format(
+                        gnRaw, gmark, gender), "patronym gender")
 
     return gn, pn, gender
 
 
+@timed("normalizeName")
 def normalizeName(gn, pn="", sn="", gender=None, dump=False):
+    if dump:
+        return _normalizeName(gn, pn, sn, gender, dump)
+    return _cachedNormalizeName(gn, pn, sn, gender)
+
+
+@memoized("normalizeName")
+def _cachedNormalizeName(gn, pn, sn, gender):
+    return _normalizeName(gn, pn, sn, gender)
+
+
+def _normalizeName(gn, pn="", sn="", gender=None, dump=False):
     gn, sn = extractSurname(gn, sn)
     # gender is explicit in given name via embedded patronym:
     # e.g. Hanna, dau. of Aisik
@@ -186,11 +483,11 @@ def normalizeName(gn, pn="", sn="", gender=None, dump=False):
     sn, skip = mapRawName(sn, "S")
     if dump:  # for debugging
         for n in gn.split():
-            info("NAME:{}:{}".format(gender, n))
+            debug("NAME:{}:{}".format(gender, n), "names")
         for n in pn.split():
-            info("NAME:{}:{}".format("M", n))
+            debug("NAME:{}:{}".format("M", n), "names")
         for n in sn.split():
-            info("NAME:{}:{}".format("S", n))
+            debug("NAME:{}:{}".format("S", n), "names")
     return (gn, pn, sn, gender)
 
 
@@ -222,53 +519,111 @@ def guessGender(gn, spouse=None):
     return gender
 
 
+_parseNameRe = re.compile(
+    r"""
+    ^\s*
+    ([\w ]+?\w)\s*
+    (?:
+        (?:ben|bat)\s+
+        ([\w ]+\w)\s+
+    )?
+    /([^/]*)/
+    \s*$
+    """,
+    re.I + re.X,
+)
+
+
 def parseName(name):
-    parseNameRe = re.compile(
-        r"""
-        ^\s*
-        ([\w ]+?\w)\s*
-        (?:
-            (?:ben|bat)\s+
-            ([\w ]+\w)\s+
-        )?
-        /([^/]*)/
-        \s*$
-        """,
-        re.I + re.X,
-    )
-    match = parseNameRe.search(name)
+    match = _parseNameRe.search(name)
     if not match:
         raise ValueError("parseName: invalid name: {}".format(name))
     return match.groups()
 
 
+# A normalized name parsed for scoring: a frozenset of the names in each of
+# its given name, patronym and surname (sets ignore spaces and order).
+def parsedName(name):
+    return tuple(frozenset((part or "").split()) for part in parseName(name))
+
+
+# score a single name part
+def _multiNameScore(n1set, n2set):
+    if not n1set or not n2set:
+        return 0.5
+    if n1set == n2set:
+        return 1  # exact match
+    if n1set < n2set or n2set < n1set:
+        # one name is subset of the other ('chasha' ⊂ "chasha leah")
+        return 0.75
+    return 0  # ('chasha leah' ≠ 'chasha rebecca')
+
+
+def parsedNameScore(parsed1, parsed2):
+    (gn1, pn1, sn1), (gn2, pn2, sn2) = parsed1, parsed2
+    return (_multiNameScore(sn1, sn2) * _multiNameScore(pn1, pn2) *
+            _multiNameScore(gn1, gn2))
+
+
 # return score in [0:1] for "confidence" that two names are the same individual
 def nameScore(n1, n2):
     if not n1 or not n2:
         return 0
-
-    # score a single name part
-    def multiNameScore(n1, n2):
-        if not n1 or not n2:
-            return 0.5
-        n1set = set(n1.split())  # set: ignores spaces and order
-        n2set = set(n2.split())
-        if n1set == n2set:
-            return 1  # exact match
-        if n1set < n2set or n2set > n1set:
-            # one name is subset of the other ('chasha' ⊂ "chasha leah")
-            return 0.75
-        return 0  # ('chasha leah' ≠ 'chasha rebecca')
-
     # Quick Check: names match exactly?
     if n1 == n2:
-        score = 1
-    else:
-        gn1, pn1, sn1 = parseName(n1)
-        # print("Name1: {} ~ {} ~ {}".format(gn1, pn1, sn1))
-        gn2, pn2, sn2 = parseName(n2)
-        score = (multiNameScore(sn1, sn2) * multiNameScore(pn1, pn2) *
-                 multiNameScore(gn1, gn2))
-    # if score > 0:
-    #     print("SCORE: '{}' ? '{}' = {:.2f}".format(n1, n2, score))
-    return score
+        return 1
+    return parsedNameScore(parsedName(n1), parsedName(n2))
+
+
+#
+# A set of names to score queries against (e.g. "who else could this be?"),
+# each parsed once when it is added.  As the score is a product, only the
+# names whose surname could score above 0 are scored: those with no surname,
+# and those (found with an index of surname words) sharing a word with the
+# query's surname.
+#
+class NameIndex:
+    def __init__(self, names=()):
+        self.names = []
+        self.parsed = []
+        self.bySurname = {}  # surname word: indexes of the names
+        self.noSurname = []
+        for name in names:
+            self.add(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    # Add a name (raises ValueError if it can't be parsed), returning its
+    # index.
+    def add(self, name):
+        parsed = parsedName(name)
+        i = len(self.names)
+        self.names.append(name)
+        self.parsed.append(parsed)
+        if parsed[2]:
+            for word in parsed[2]:
+                self.bySurname.setdefault(word, []).append(i)
+        else:
+            self.noSurname.append(i)
+        return i
+
+    def _candidates(self, surname):
+        if not surname:
+            return range(len(self.names))
+        candidates = set(self.noSurname)
+        for word in surname:
+            candidates.update(self.bySurname.get(word, ()))
+        return sorted(candidates)
+
+    # The (score, name, index) of the k best scoring names, at least
+    # threshold (and above 0), best first.
+    def best(self, name, k=10, threshold=0.5):
+        query = parsedName(name)
+        found = []
+        for i in self._candidates(query[2]):
+            score = 1 if name == self.names[i] else parsedNameScore(
+                query, self.parsed[i])
+            if score and score >= threshold:
+                found.append((score, self.names[i], i))
+        return heapq.nlargest(k, found, key=itemgetter(0))
@@ -1,55 +1,9 @@
 import re
 
 from .person import Person
+from .timing import timed
 from .utils import info, warning
 
-# output field, and description
-fieldInfo = (
-    ("File", "The name of the source spreadsheet for this record"),
-    ("Row", "The spreadsheet row number on which this record appears."),
-    ("Source Description", "A brief description that identifies the record."),
-    ("Name", "The normalized name of an individual mentioned in a record."),
-    ("Gender", "Male, Female, or Unknown. An educated"
-     " guess based on role and name."),
-    ("Role", "The role of the individual with respect to this record."),
-    ("Birth Date",
-     "The date of birth. Gregorian calendar. May be approximate."),
-    (
-        "Birth Note",
-        "If approximate, how it was derived (e.g. from age, "
-        "or relation to child or spouse)",
-    ),
-    ("Birth Place", "The town, district, province of the birth."),
-    ("Death Date", "The date of death. Gregorian calendar."),
-    (
-        "Death Note",
-        "If approximate, how it was derived"
-        " (e.g. from age, or relation to spouse)",
-    ),
-    ("Death Place", "The town, district, province of the death."),
-    ("Marriage Date", "The date of marriage. Gregorian calendar."),
-    ("Marriage Place", "The town, district, province of the marriage."),
-    ("Source",
-     "As indicated on the spreadsheet, typically archive/fond/list/item"),
-    ("Microfilm", "As indicated on the spreadsheet"),
-    ("Recorded On", "Year recorded, in source spreadsheet."),
-    ("Recorded At", "Place recorded, in source spreadsheet."),
-    ("Record Number", "Record number in source spreadsheet."),
-    ("Source Given Name", "The raw given name from the source record."),
-    ("Source Surname", "The raw surname from the source record."),
-    (
-        "Source Date",
-        "The event date as it is in the source record, Julian Day/Month/Year.",
-    ),
-    (
-        "Source Place",
-        "The event place as it is in the source record, Town, Uyezd, Gubernia",
-    ),
-    ("Errors", "Description"),
-)
-
-fieldNames = (x[0] for x in fieldInfo)
-
 monthNames = (
     "Jan",
     "Feb",
@@ -89,6 +43,7 @@ _witnessRe = re.compile(
 )
 
 
+@timed("formatJulianAsGregorian")
 def formatJulianAsGregorian(Y, M, D):
     def cleanNum(v):
         if v is None:
@@ -234,14 +189,17 @@ def dateBasedOnAgeAndYear(ageRaw, yearRaw):
         num = 0
     num = int(num)
     if not 0 <= num < 120:  # ignore crazy ages
-        warning("Impossible age: {}".format(ageRaw))
+        warning("Impossible age: {}".format(ageRaw), "impossible age")
     if not yearRaw:
-        info("Age but no base year: {}, {}".format(ageRaw, yearRaw))
+        info("Age but no base year: {}, {}".format(ageRaw, yearRaw),
+             "no base year")
     year = extractNum(yearRaw)
     if year == -1:
-        info("Age but no base year: {}, {}".format(ageRaw, yearRaw))
+        info("Age but no base year: {}, {}".format(ageRaw, yearRaw),
+             "no base year")
     elif year < MINYEAR:
-        warning("Impossible year: {} ({})".format(yearRaw, year))
+        warning("Impossible year: {} ({})".format(yearRaw, year),
+                "impossible year")
     return (
         "{}".format(year - num),
         year - num,
@@ -249,6 +207,7 @@ def dateBasedOnAgeAndYear(ageRaw, yearRaw):
     )
 
 
+@timed("calcBirthFromAge")
 def calcBirthFromAge(yearRaw,
                      ageRaw=None,
                      generation=1,
@@ -279,40 +238,44 @@ def calcBirthFromAge(yearRaw,
                                              genYears)
         if result:
             return result
-        warning("Unable to process birth year for estimate: {}".format(
-            genBirthYear))
+        warning(
+            "Unable to process birth year for estimate: {}".format(
+                genBirthYear), "birth estimate")
     return None, None, None
 
 
+#
+# Output rows are tuples of values in fieldInfo order.  The fields that are
+# common to every person in a record are computed once per record, as the
+# three runs of fields that surround the person's own fields
+# (see Person.normalizedFields).
+#
 def commonFields(d, principalName):
-    return {
-        "File":
-        d["fileName"],
-        "Row":
-        d["rowNum"],
-        "Source":
-        d["source: archive / fond / list / item"],
-        "Microfilm":
-        d["microfilm #"],
-        "Recorded On":
-        d["year recorded"],
-        "Recorded At":
-        d["place recorded"],
-        "Record Number":
-        d["record #"],
-        "Source Date":
-        "/".join([str(d["d"]), str(d["m"]),
-                  str(d["y"])]),
-        "Source Place":
-        ",".join([d["town"], d["uyezd"], d["gubernia"]]),
-        "Source Description":
-        "{} of {} in {} {}".format(
-            (d.get("marriage or divorce", None) or d["fileType"]).title(),
-            principalName,
-            d["y"],
-            d["town"],
-        ).strip(),
-    }
+    return (
+        (
+            d["fileName"],
+            d["rowNum"],
+            "{} of {} in {} {}".format(
+                (d.get("marriage or divorce", None) or d["fileType"]).title(),
+                principalName,
+                d["y"],
+                d["town"],
+            ).strip(),
+        ),
+        (
+            d["source: archive / fond / list / item"],
+            d["microfilm #"],
+            d["year recorded"],
+            d["place recorded"],
+            d["record #"],
+        ),
+        (
+            "/".join([str(d["d"]), str(d["m"]),
+                      str(d["y"])]),
+            ",".join([d["town"], d["uyezd"], d["gubernia"]]),
+            "",  # Errors
+        ),
+    )
 
 
 def getParentsAge(d):
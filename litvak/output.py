@@ -0,0 +1,302 @@
+import bz2
+import csv
+import gzip
+import io
+import json
+import lzma
+import os
+import re
+import sqlite3
+import sys
+from operator import itemgetter
+
+from .fields import fieldNames
+from .timing import timed
+
+#
+# Writers for the normalized output rows (tuples in fieldInfo order).
+# Each writer is given the names of the fields to emit, and takes care of
+# projecting the rows onto them.
+#
+
+
+# A function that picks the given fields out of a row, or None if that
+# would be all of them, in order.
+def projection(fieldnames):
+    if list(fieldnames) == list(fieldNames):
+        return None
+    indexes = [fieldNames.index(name) for name in fieldnames]
+    if len(indexes) == 1:
+        # itemgetter of a single index returns a value, not a tuple
+        index = indexes[0]
+        return lambda row: (row[index], )
+    return itemgetter(*indexes)
+
+
+# Output text is written through a large buffer, so the writers aren't
+# making a system call (or a compressor call) for every row.
+BUFFER_SIZE = 1 << 20
+
+# compressed output, by file extension
+_compressors = {
+    ".gz": gzip.open,
+    ".bz2": bz2.open,
+    ".xz": lzma.open,
+}
+
+
+# Open a text output file: "-" is stdout, and a file with a compressed
+# extension (e.g. normalized.csv.gz) is compressed.
+def openTextOutput(fileName):
+    if fileName == "-":
+        return open(sys.stdout.fileno(),
+                    "w",
+                    buffering=BUFFER_SIZE,
+                    newline="",
+                    closefd=False)
+    compressor = _compressors.get(os.path.splitext(fileName)[1].lower())
+    if compressor:
+        return io.TextIOWrapper(
+            io.BufferedWriter(compressor(fileName, "wb"), BUFFER_SIZE),
+            newline="",
+        )
+    return open(fileName, "w", buffering=BUFFER_SIZE, newline="")
+
+
+class CsvOutput:
+    def __init__(self, fileName, fieldnames):
+        self.fileName = fileName
+        self.f = openTextOutput(fileName)
+        self.writer = csv.writer(self.f)
+        self.writer.writerow(fieldnames)
+        self.project = projection(fieldnames)
+
+    @timed("write output")
+    def writeRows(self, rows):
+        if self.project:
+            rows = map(self.project, rows)
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.f.close()
+
+
+#
+# An SQLite database, with a "persons" table holding the output fields,
+# plus some columns derived from them for searching:
+#   surname     - the normalized surname, in uppercase
+#   birth_year  - the year of the birth date
+#   town        - the town of the record (from the source place)
+#   birth_town  - the town of the birth place
+# and a "name_tokens" table, holding each of the (uppercase) names in the
+# normalized given name (G), patronym (P) and surname (S) of each person.
+#
+# For example, every CHAIM /RUBENSTEIN/ born 1840-1860 in Sejny:
+#
+#   SELECT persons.* FROM persons JOIN name_tokens ON person_id = id
+#   WHERE token = 'CHAIM' AND kind = 'G' AND surname = 'RUBENSTEIN'
+#   AND birth_year BETWEEN 1840 AND 1860 AND town = 'Sejny'
+#
+_yearRe = re.compile(r"\b(\d{4})\b")
+
+_NAME = fieldNames.index("Name")
+_BIRTH_DATE = fieldNames.index("Birth Date")
+_BIRTH_PLACE = fieldNames.index("Birth Place")
+_SOURCE_PLACE = fieldNames.index("Source Place")
+
+
+def _columnName(field):
+    return field.lower().replace(" ", "_")
+
+
+def _splitName(name):
+    # imported here, so choosing an output format doesn't load the lexicon
+    from .names import parseName
+
+    try:
+        return parseName(name)
+    except ValueError:
+        given, skip, surname = str(name).partition("/")
+        return given, None, surname.strip("/ ")
+
+
+def _town(place):
+    town = place.split(",")[0] if place else None
+    return town or None
+
+
+def _year(date):
+    match = _yearRe.search(date) if date else None
+    return int(match.group(1)) if match else None
+
+
+class SqliteOutput:
+    def __init__(self, fileName, fieldnames):
+        self.fileName = fileName
+        self.project = projection(fieldnames)
+        self.nextId = 0
+        self.db = sqlite3.connect(fileName, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("DROP TABLE IF EXISTS name_tokens")
+        self.db.execute("DROP TABLE IF EXISTS persons")
+        columns = [_columnName(field) for field in fieldnames]
+        self.hasFile = "file" in columns
+        self.db.execute("CREATE TABLE persons ({})".format(", ".join([
+            "id INTEGER PRIMARY KEY",
+            *columns,
+            "surname TEXT",
+            "birth_year INTEGER",
+            "town TEXT",
+            "birth_town TEXT",
+        ])))
+        self.db.execute("CREATE TABLE name_tokens "
+                        "(person_id INTEGER, kind TEXT, token TEXT)")
+        self.insertPerson = "INSERT INTO persons VALUES ({})".format(
+            ", ".join(["?"] * (len(columns) + 5)))
+        # everything goes in a single transaction
+        self.db.execute("BEGIN")
+
+    @timed("write output")
+    def writeRows(self, rows):
+        persons = []
+        tokens = []
+        for row in rows:
+            self.nextId += 1
+            given, patronym, surname = _splitName(row[_NAME])
+            for kind, names in (("G", given), ("P", patronym),
+                                ("S", surname)):
+                for token in (names or "").upper().split():
+                    tokens.append((self.nextId, kind, token))
+            persons.append((
+                self.nextId,
+                *(self.project(row) if self.project else row),
+                surname.upper() if surname else None,
+                _year(row[_BIRTH_DATE]),
+                _town(row[_SOURCE_PLACE]),
+                _town(row[_BIRTH_PLACE]),
+            ))
+        self.db.executemany(self.insertPerson, persons)
+        self.db.executemany("INSERT INTO name_tokens VALUES (?, ?, ?)",
+                            tokens)
+
+    def close(self):
+        # indexes are faster to build once the rows are in
+        indexes = [
+            ("name_tokens_token", "name_tokens (token, kind)"),
+            ("name_tokens_person", "name_tokens (person_id)"),
+            ("persons_surname", "persons (surname, birth_year)"),
+            ("persons_birth_year", "persons (birth_year)"),
+            ("persons_town", "persons (town)"),
+            ("persons_birth_town", "persons (birth_town)"),
+        ]
+        if self.hasFile:
+            indexes.append(("persons_file", "persons (file)"))
+        for name, index in indexes:
+            self.db.execute("CREATE INDEX {} ON {}".format(name, index))
+        self.db.execute("COMMIT")
+        self.db.execute("ANALYZE")
+        self.db.close()
+
+
+#
+# JSON Lines: one object per output row, keyed by field name.  Numeric
+# fields are ints, empty fields are null, and each date is an object:
+#   {"value": "1850-03-04", "precision": "day", "note": "..."}
+# where precision is "day", "year" or "before" (the year), and the note is
+# the date's note field (which is then not emitted separately).
+#
+# Rows are written as they are passed in (a batch at a time, by
+# processFiles), so memory use doesn't grow with the size of the output.
+#
+_intFields = ("Row", "Record Number", "Recorded On")
+_dateFields = {
+    "Birth Date": "Birth Note",
+    "Death Date": "Death Note",
+    "Marriage Date": None,
+}
+
+_intRe = re.compile(r"^\s*(\d+)\s*$")
+_dayRe = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+# formatJulianAsGregorian gives "0-Y" when there is a day but no month
+_yearOnlyRe = re.compile(r"^(?:\d+-)?(\d{4})$")
+_beforeRe = re.compile(r"^before (\d{4})$")
+
+
+def _jsonValue(v):
+    return None if v is None or v == "" else v
+
+
+def _jsonInt(v):
+    if isinstance(v, str):
+        match = _intRe.match(v)
+        if match:
+            return int(match.group(1))
+    return _jsonValue(v)
+
+
+def _jsonDate(date, note):
+    if not date:
+        return None
+    date = str(date)
+    precision = None
+    if _dayRe.match(date):
+        precision = "day"
+    else:
+        match = _yearOnlyRe.match(date)
+        if match:
+            date, precision = match.group(1), "year"
+        else:
+            match = _beforeRe.match(date)
+            if match:
+                date, precision = match.group(1), "before"
+    return {"value": date, "precision": precision, "note": note or None}
+
+
+class JsonlOutput:
+    def __init__(self, fileName, fieldnames):
+        self.fileName = fileName
+        self.f = openTextOutput(fileName)
+        # notes that are emitted as part of their date
+        folded = {_dateFields[name] for name in fieldnames
+                  if name in _dateFields}
+        # (name, function of the row) for each emitted key
+        self.fields = []
+        for name in fieldnames:
+            i = fieldNames.index(name)
+            if name in _dateFields:
+                note = _dateFields[name]
+                j = fieldNames.index(note) if note else None
+                self.fields.append(
+                    (name, lambda row, i=i, j=j: _jsonDate(
+                        row[i], row[j] if j is not None else None)))
+            elif name in folded:
+                continue
+            elif name in _intFields:
+                self.fields.append((name, lambda row, i=i: _jsonInt(row[i])))
+            else:
+                self.fields.append(
+                    (name, lambda row, i=i: _jsonValue(row[i])))
+
+    @timed("write output")
+    def writeRows(self, rows):
+        for row in rows:
+            self.f.write(
+                json.dumps({name: get(row)
+                            for name, get in self.fields},
+                           ensure_ascii=False))
+            self.f.write("\n")
+
+    def close(self):
+        self.f.close()
+
+
+outputFormats = {
+    "csv": CsvOutput,
+    "jsonl": JsonlOutput,
+    "sqlite": SqliteOutput,
+}
+
+
+def openOutput(fileName, fieldnames, format="csv"):
+    return outputFormats[format](fileName, fieldnames)
@@ -1,8 +1,11 @@
+import glob
 import os
+import pickle
 
 from xlrd import open_workbook
 
-from .utils import info, setWarningContext, warning
+from .timing import stage, timed
+from .utils import debug, fileHash, info, setWarningContext, warning
 
 # from pprint import pprint
 
@@ -96,7 +99,7 @@ fileTypeMap = {
 
 def getRowHeader(xlsFileName, row):
     header = []
-    info("File columns for: {}".format(xlsFileName))
+    debug("File columns for: {}".format(xlsFileName), "columns")
     last = ""
     for i, k in enumerate(row):
         # hack bad column names
@@ -111,26 +114,181 @@ def getRowHeader(xlsFileName, row):
             k = _keyMap.get(k, k)
         header.append(k)
         last = k
-        info(" {:2d}. {}".format(i, k))
+        debug(" {:2d}. {}".format(i, k), "columns")
     return header
 
 
-def xlsRows(xlsFileName):
-    wb = open_workbook(xlsFileName)
+def _readSheet(xlsFileName, lowMemory=False):
+    # In low memory mode, only the sheet we use is loaded, and it is
+    # released as soon as we are done with it.  (xlrd maps the file, rather
+    # than reading it, in either mode.)
+    with stage("open workbook"):
+        wb = open_workbook(xlsFileName, on_demand=lowMemory)
+    try:
+        with stage("load sheet"):
+            # Sometimes the first sheet is a cover sheet, sometimes it is data
+            if "Chronological" in wb.sheet_names():
+                sh = wb.sheet_by_name("Chronological")
+            else:
+                sh = wb.sheet_by_index(0)
+        for rowNum in range(sh.nrows):
+            yield sh.row_values(rowNum)
+    finally:
+        if lowMemory:
+            wb.release_resources()
+
+
+#
+# Decoding a spreadsheet with xlrd is slow, so the decoded row values of the
+# sheet we use are cached in a .xlscache directory next to the spreadsheet,
+# keyed by the hash of the spreadsheet's contents.
+#
+# A cache file is a series of pickled lists of (at most _CACHE_BATCH) rows,
+# written as the sheet is read, and read back a list at a time, so the sheet
+# is never held in memory whole.
+#
+_CACHE_DIR = ".xlscache"
+_CACHE_VERSION = 2
+_CACHE_BATCH = 1000
+
+
+def _loadCachedSheet(cacheFileName):
+    with open(cacheFileName, "rb") as f:
+        while True:
+            with stage("load cached sheet"):
+                try:
+                    rows = pickle.load(f)
+                except EOFError:
+                    return
+            yield from rows
+
+
+class _SheetCacheWriter:
+    def __init__(self, xlsFileName, cacheFileName):
+        self.xlsFileName = xlsFileName
+        self.cacheFileName = cacheFileName
+        self.tmpName = "{}.{}.tmp".format(cacheFileName, os.getpid())
+        self.batch = []
+        self.f = None
+        self.written = False
+        try:
+            os.makedirs(os.path.dirname(cacheFileName), exist_ok=True)
+            self.f = open(self.tmpName, "wb")
+        except OSError as e:
+            self.failed(e)
+
+    def failed(self, e):
+        info("Unable to cache {}: {}".format(self.xlsFileName, e), "cache")
+        self.discard()
+
+    def discard(self):
+        if self.f:
+            self.f.close()
+            self.f = None
+        if not self.written:
+            try:
+                os.remove(self.tmpName)
+            except OSError:
+                pass
+
+    def _dump(self):
+        try:
+            pickle.dump(self.batch, self.f, pickle.HIGHEST_PROTOCOL)
+        except OSError as e:
+            self.failed(e)
+        self.batch = []
+
+    def add(self, row):
+        if self.f:
+            self.batch.append(row)
+            if len(self.batch) >= _CACHE_BATCH:
+                self._dump()
+
+    # Put the cache file in place, replacing the caches of earlier versions
+    # of the spreadsheet.
+    def finish(self):
+        if self.f and self.batch:
+            self._dump()
+        if not self.f:
+            return
+        try:
+            self.f.close()
+            self.f = None
+            for oldFileName in glob.glob(
+                    os.path.join(
+                        os.path.dirname(self.cacheFileName),
+                        glob.escape(os.path.basename(self.xlsFileName)) +
+                        ".*.pickle")):
+                os.remove(oldFileName)
+            os.replace(self.tmpName, self.cacheFileName)
+            self.written = True
+        except OSError as e:
+            self.failed(e)
+
+
+# Yield the rows of the sheet, writing them to the cache file as they go by.
+# If the reader stops early (e.g. at an unknown file type), the rest of the
+# rows are still cached.
+def _cacheSheet(xlsFileName, cacheFileName, lowMemory=False):
+    writer = _SheetCacheWriter(xlsFileName, cacheFileName)
+    rows = _readSheet(xlsFileName, lowMemory)
+    try:
+        for row in rows:
+            writer.add(row)
+            yield row
+    except GeneratorExit:
+        for row in rows:
+            writer.add(row)
+        writer.finish()
+        raise
+    else:
+        writer.finish()
+    finally:
+        writer.discard()  # unless it was finished
+
+
+def _cachedSheet(xlsFileName, lowMemory=False):
+    cacheDir = os.path.join(os.path.dirname(xlsFileName), _CACHE_DIR)
+    baseName = os.path.basename(xlsFileName)
+    cacheFileName = os.path.join(
+        cacheDir, "{}.{}.v{}.pickle".format(baseName, fileHash(xlsFileName),
+                                             _CACHE_VERSION))
+    loaded = 0
+    try:
+        for row in _loadCachedSheet(cacheFileName):
+            loaded += 1
+            yield row
+        return
+    except (OSError, pickle.UnpicklingError):
+        if loaded:
+            raise  # too late to decode the sheet instead
+    yield from _cacheSheet(xlsFileName, cacheFileName, lowMemory)
+
+
+def _sheetRows(xlsFileName, cache=False, lowMemory=False):
+    if cache:
+        rows = _cachedSheet(xlsFileName, lowMemory)
+    else:
+        rows = _readSheet(xlsFileName, lowMemory)
+    for rowNum, row in enumerate(rows):
+        yield rowNum + 1, row
+
+
+#
+# Yield (header, fileType, rowNum, row) for each data row of a spreadsheet.
+# Header rows are consumed here: each one switches the schema (header) that
+# applies to the data rows that follow it.
+#
+def _schemaRows(xlsFileName, cache=False, lowMemory=False):
     header = None
     fileType = None
     baseName = os.path.basename(xlsFileName)
-    # Sometimes the first sheet is a cover sheet, sometimes it is data
-    if "Chronological" in wb.sheet_names():
-        sh = wb.sheet_by_name("Chronological")
-    else:
-        sh = wb.sheet_by_index(0)
 
+    setWarningContext(xlsFileName, "")
     # Iterate over all the rows, looking for a good header row
     # (it is usually in row 1,2 or 3)
-    for rowNum in range(sh.nrows):
-        setWarningContext(xlsFileName, rowNum + 1)
-        row = sh.row_values(rowNum)
+    for rowNum, row in _sheetRows(xlsFileName, cache, lowMemory):
+        setWarningContext(xlsFileName, rowNum)
         if "Record #" in row:
             header = getRowHeader(baseName, row)
             # Determine what kind of records this file contains,
@@ -140,21 +298,66 @@ def xlsRows(xlsFileName):
                     fileType = value
                     break
             if not fileType:
-                warning("Unknown file type. {}".format(xlsFileName))
+                warning("Unknown file type. {}".format(xlsFileName),
+                        "unknown file type")
                 return
             continue
         if not fileType:
             continue
-        d = {
-            k: row[i].strip() if isinstance(row[i], str) else int(row[i])
-            for i, k in enumerate(header)
-        }
-        d["rowNum"] = rowNum + 1
-        d["fileName"] = baseName
-        d["fileType"] = fileType
-        if "year recorded" not in d:
-            d["year recorded"] = d["y"]
-        if not d["y"]:
-            d["y"] = d["year recorded"]
-        yield d
+        yield header, fileType, rowNum, row
+
+
+@timed("decode row")
+def _rowDict(baseName, header, fileType, rowNum, row):
+    d = {
+        k: row[i].strip() if isinstance(row[i], str) else int(row[i])
+        for i, k in enumerate(header)
+    }
+    d["rowNum"] = rowNum
+    d["fileName"] = baseName
+    d["fileType"] = fileType
+    if "year recorded" not in d:
+        d["year recorded"] = d["y"]
+    if not d["y"]:
+        d["y"] = d["year recorded"]
+    return d
+
+
+def xlsRows(xlsFileName, cache=False, lowMemory=False):
+    baseName = os.path.basename(xlsFileName)
+    for header, fileType, rowNum, row in _schemaRows(xlsFileName, cache,
+                                                      lowMemory):
+        yield _rowDict(baseName, header, fileType, rowNum, row)
+    setWarningContext("", "")
+
+
+#
+# Split the data rows of a spreadsheet into shards of at most shardSize
+# consecutive rows, so they can be normalized by separate workers.
+# Each shard is (xlsFileName, header, fileType, firstRowNum, rows), where rows
+# are the raw row values.  A shard never spans a header row, so every row in
+# it has the same schema, and header rows are only parsed (and logged) once.
+#
+def xlsShards(xlsFileName, shardSize=5000, cache=False, lowMemory=False):
+    shard = None
+    for header, fileType, rowNum, row in _schemaRows(xlsFileName, cache,
+                                                      lowMemory):
+        if shard and (shard[1] is not header or len(shard[4]) >= shardSize):
+            yield shard
+            shard = None
+        if not shard:
+            shard = (xlsFileName, header, fileType, rowNum, [])
+        shard[4].append(row)
+    if shard:
+        yield shard
+    setWarningContext("", "")
+
+
+# The rows of a shard from xlsShards, as xlsRows would have yielded them.
+def shardRows(shard):
+    xlsFileName, header, fileType, firstRowNum, rows = shard
+    baseName = os.path.basename(xlsFileName)
+    for i, row in enumerate(rows):
+        setWarningContext(xlsFileName, firstRowNum + i)
+        yield _rowDict(baseName, header, fileType, firstRowNum + i, row)
     setWarningContext("", "")
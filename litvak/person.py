@@ -1,6 +1,7 @@
 from enum import Enum
 
 from .names import normalizeName, oppositeGender
+from .timing import timed
 from .utils import warning
 
 
@@ -10,6 +11,7 @@ class Gender(Enum):
 
 
 class Person:
+    @timed("Person")
     def __init__(self, given, surname="", father=None, gender=None):
         self.sourceGiven = given
         self.sourceSurname = surname
@@ -47,22 +49,24 @@ class Person:
         if self.normalizedPatronym:
             if (father.normalizedGiven and father.normalizedGiven.lower() !=
                     self.normalizedPatronym.lower()):
-                warning("{} has patronym {} != father's given name {}.".format(
-                    self.formatName(False),
-                    self.normalizedPatronym,
-                    father.normalizedGiven,
-                ))
+                warning(
+                    "{} has patronym {} != father's given name {}.".format(
+                        self.formatName(False),
+                        self.normalizedPatronym,
+                        father.normalizedGiven,
+                    ), "patronym mismatch")
             elif not father.normalizedGiven:
                 father.normalizedGiven = self.normalizedPatronym
                 father.normalizedPatronym = ""
         if self.normalizedSurname:
             if (father.normalizedSurname and father.normalizedSurname.lower()
                     != self.normalizedSurname.lower()):
-                warning("{} has surname {} != father's surname {}.".format(
-                    self.formatName(False),
-                    self.normalizedSurname,
-                    father.normalizedSurname,
-                ))
+                warning(
+                    "{} has surname {} != father's surname {}.".format(
+                        self.formatName(False),
+                        self.normalizedSurname,
+                        father.normalizedSurname,
+                    ), "surname mismatch")
             else:
                 father.normalizedSurname = self.normalizedSurname
 
@@ -82,22 +86,28 @@ class Person:
                                       self.normalizedSurname).strip()
         return "{} {}".format(self.sourceGiven, self.sourceSurname).strip()
 
-    def normalizedFields(self):
-        return {
-            "Source Given Name": self.sourceGiven,
-            "Source Surname": self.sourceSurname,
-            "Name": self.formatName(True),
-            "Gender": self.gender,
-            "Birth Date": self.birthDate,
-            "Birth Note": self.birthNote,
-            "Birth Place": self.birthPlace,
-            "Death Date": self.deathDate,
-            "Death Note": self.deathNote,
-            "Death Place": self.deathPlace,
-            "Marriage Date": self.marriageDate,
-            "Marriage Place": self.marriagePlace,
-            "Role": self.role,
-        }
+    # The output row for this person, in fieldInfo order,
+    # given the record's commonFields.
+    def normalizedFields(self, common):
+        head, middle, tail = common
+        return (
+            *head,
+            self.formatName(True),
+            self.gender,
+            self.role,
+            self.birthDate,
+            self.birthNote,
+            self.birthPlace,
+            self.deathDate,
+            self.deathNote,
+            self.deathPlace,
+            self.marriageDate,
+            self.marriagePlace,
+            *middle,
+            self.sourceGiven,
+            self.sourceSurname,
+            *tail,
+        )
 
     #
     # for debugging
@@ -110,6 +120,7 @@ class Person:
 
 
 # build the names of a common family group: child, two parents, with patronyms.
+@timed("buildFamily")
 def buildFamily(
     givenName,
     surname,
@@ -0,0 +1,102 @@
+#
+# Daitch-Mokotoff soundex, for matching spellings of a name that sound
+# alike (e.g. Eidlja, Eydlia, Ejdla).
+# Ref: https://www.jewishgen.org/InfoFiles/soundex.html
+#
+# A name is coded letter group by letter group, with the longest group that
+# matches at each position.  Each group has a code for when it starts the
+# name, for when it is followed by a vowel, and otherwise ("" when it isn't
+# coded).  Some groups can be pronounced two ways, and have a second set of
+# codes, so a name can have more than one soundex code.
+#
+import unicodedata
+
+_VOWELS = "AEIOU"
+
+# group: ((start, before vowel, other), alternative or None)
+_rules = {}
+
+
+def _rule(groups, start, beforeVowel, other, alternative=None):
+    for group in groups.split():
+        _rules[group] = ((start, beforeVowel, other), alternative)
+
+
+_rule("AI AJ AY", "0", "1", "")
+_rule("AU", "0", "7", "")
+_rule("A", "0", "", "")
+_rule("B", "7", "7", "7")
+_rule("CHS", "5", "54", "54")
+_rule("CH", "5", "5", "5", ("4", "4", "4"))
+_rule("CK", "5", "5", "5", ("45", "45", "45"))
+_rule("CSZ CZS CS CZ", "4", "4", "4")
+_rule("C", "5", "5", "5", ("4", "4", "4"))
+_rule("DRZ DRS DS DSH DSZ DZ DZH DZS", "4", "4", "4")
+_rule("D DT", "3", "3", "3")
+_rule("EI EJ EY", "0", "1", "")
+_rule("EU", "1", "1", "")
+_rule("E", "0", "", "")
+_rule("FB F", "7", "7", "7")
+_rule("G", "5", "5", "5")
+_rule("H", "5", "5", "")
+_rule("IA IE IO IU", "1", "", "")
+_rule("I", "0", "", "")
+_rule("J", "1", "", "", ("4", "4", "4"))
+_rule("KS", "5", "54", "54")
+_rule("KH K", "5", "5", "5")
+_rule("L", "8", "8", "8")
+_rule("MN NM", "66", "66", "66")
+_rule("M N", "6", "6", "6")
+_rule("OI OJ OY", "0", "1", "")
+_rule("O", "0", "", "")
+_rule("P PF PH", "7", "7", "7")
+_rule("Q", "5", "5", "5")
+_rule("RZ RS", "94", "94", "94", ("4", "4", "4"))
+_rule("R", "9", "9", "9")
+_rule("SCHTSCH SCHTSH SCHTCH SHTCH SHCH SHTSH STCH STSCH SC STRZ STRS "
+      "STSH SZCZ SZCS", "2", "4", "4")
+_rule("SHT SCHT SCHD ST SZT SHD SZD SD", "2", "43", "43")
+_rule("SCH SH SZ S", "4", "4", "4")
+_rule("TCH TTCH TTSCH TRZ TRS TSCH TSH TS TTS TTSZ TC TZ TTZ TZS TSZ", "4",
+      "4", "4")
+_rule("TH T", "3", "3", "3")
+_rule("UI UJ UY", "0", "1", "")
+_rule("U UE", "0", "", "")
+_rule("V W", "7", "7", "7")
+_rule("X", "5", "54", "54")
+_rule("Y", "1", "", "")
+_rule("ZDZ ZDZH ZHDZH", "2", "4", "4")
+_rule("ZD ZHD", "2", "43", "43")
+_rule("ZH ZS ZSCH ZSH Z", "4", "4", "4")
+
+_longestRule = max(len(group) for group in _rules)
+
+
+def _letters(name):
+    # drop accents (e.g. Ą -> A) and anything else that isn't a letter
+    name = unicodedata.normalize("NFKD", name).upper()
+    return "".join(c for c in name if "A" <= c <= "Z")
+
+
+# The soundex codes (six digits) of a name, as a set.
+def soundex(name):
+    name = _letters(name)
+    # each branch is (digits so far, code of the last letter group)
+    branches = [("", None)]
+    i = 0
+    while i < len(name):
+        for length in range(min(_longestRule, len(name) - i), 0, -1):
+            group = name[i:i + length]
+            if group in _rules:
+                break
+        codes, alternative = _rules[group]
+        nextLetter = name[i + length:i + length + 1]
+        column = 0 if i == 0 else 1 if nextLetter and (
+            nextLetter in _VOWELS) else 2
+        choices = [codes[column]]
+        if alternative:
+            choices.append(alternative[column])
+        branches = [(digits if code == last else digits + code, code)
+                    for digits, last in branches for code in choices]
+        i += length
+    return {(digits + "000000")[:6] for digits, last in branches}
@@ -0,0 +1,230 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from .birth import processBirth
+from .death import processDeath
+from .manifest import Manifest
+from .marriage import processMarriage
+from .names import (fuzzyNames, phoneticNames, setFuzzyNames,
+                    setPhoneticNames)
+from .parsexls import shardRows, xlsRows, xlsShards
+from .timing import (drainTimings, enableTiming, mergeTimings, stage, timed,
+                     timingEnabled)
+from .utils import (configureDiagnostics, drainDiagnostics, endRecordErrors,
+                    info, replayDiagnostics, setWarningContext,
+                    startRecordErrors, workerDiagnosticsConfig)
+
+# record processors, by the fileType that xlsRows assigns to each row
+_processors = {
+    "Birth": timed("processBirth")(processBirth),
+    "Death": timed("processDeath")(processDeath),
+    "Marriage": timed("processMarriage")(processMarriage),
+}
+
+
+# The output rows of a record, with any warnings raised while processing it
+# in their Errors field.
+def processRecord(d):
+    processor = _processors.get(d["fileType"])
+    if not processor:
+        return []
+    startRecordErrors()
+    try:
+        rows = processor(d)
+    finally:
+        errors = endRecordErrors()
+    if errors:
+        rows = [row[:-1] + (errors, ) for row in rows]
+    return rows
+
+
+# Output rows are passed on in batches of about this many, as their records
+# are processed, so a large spreadsheet's output is never all held at once.
+BATCH_ROWS = 1000
+
+
+#
+# Yield the output of a file's records in chunks:
+#   (fileName, fileType, record count, output rows)
+# At least one chunk is yielded, even if there are no records.
+#
+def _processRecords(fileName, records):
+    fileType = None
+    count = 0
+    rows = []
+    empty = True
+    for d in records:
+        fileType = d["fileType"]
+        count += 1
+        rows.extend(processRecord(d))
+        if len(rows) >= BATCH_ROWS:
+            yield fileName, fileType, count, rows
+            empty = False
+            count = 0
+            rows = []
+    if count or empty:
+        yield fileName, fileType, count, rows
+
+
+def fileChunks(fileName, xlsOptions=None):
+    records = xlsRows(fileName, **(xlsOptions or {}))
+    return _processRecords(fileName, records)
+
+
+#
+# processFile and processShard run in a worker, and return a list of the
+# chunks, which is passed back whole.  A shard's rows are bounded by the
+# shard size, but a file's are not.
+#
+def processFile(fileName, xlsOptions=None):
+    return list(fileChunks(fileName, xlsOptions))
+
+
+def processShard(shard):
+    return list(_processRecords(shard[0], shardRows(shard)))
+
+
+# The shards of a file, or a single empty shard if it has no data rows,
+# so that every file produces at least one chunk.
+def _fileShards(fileName, shardSize, xlsOptions):
+    empty = True
+    for shard in xlsShards(fileName, shardSize, **(xlsOptions or {})):
+        empty = False
+        yield shard
+    if empty:
+        yield (fileName, None, None, 0, [])
+
+
+def _initWorker(timing, diagnostics, fuzzy, phonetic):
+    enableTiming(timing)
+    configureDiagnostics(**diagnostics)
+    setFuzzyNames(fuzzy)
+    setPhoneticNames(phonetic)
+
+
+# Run a task in a worker, and send back its timings and diagnostics along
+# with the result.
+def _workerTask(fn, task):
+    result = fn(task)
+    return (result, drainTimings() if timingEnabled() else None,
+            drainDiagnostics())
+
+
+def _workerResult(future):
+    result, timings, diagnostics = future.result()
+    if timings:
+        mergeTimings(timings)
+    replayDiagnostics(diagnostics)
+    return result
+
+
+# Like executor.map, but only keeps a window of tasks in flight, so we don't
+# hold every shard of the corpus in memory at once.
+def _orderedMap(executor, fn, tasks, window):
+    pending = deque()
+    for task in tasks:
+        pending.append(executor.submit(_workerTask, fn, task))
+        if len(pending) >= window:
+            yield _workerResult(pending.popleft())
+    while pending:
+        yield _workerResult(pending.popleft())
+
+
+def _chunks(results):
+    for chunks in results:
+        yield from chunks
+
+
+#
+# Yield the output chunks of the files (see _processRecords), in the order
+# of the files given, and in row order within each file.  Every file yields
+# at least one chunk.
+# With jobs > 1 the files are normalized in a pool of worker processes, but
+# the results are still yielded in order, so the output doesn't depend on
+# how many workers there are.
+#
+# xlsOptions are passed on to xlsRows/xlsShards (e.g. cache, lowMemory).
+#
+# With shardSize, the spreadsheets are read here, and split into shards of
+# at most shardSize rows, so that the rows of a single large spreadsheet are
+# also spread across the workers.  (A worker passes back the whole output
+# of its task, so this also bounds the memory used for a large spreadsheet.)
+#
+def processChunks(fileNames, jobs=1, shardSize=None, xlsOptions=None):
+    if jobs <= 1:
+        for fileName in fileNames:
+            yield from fileChunks(fileName, xlsOptions)
+        return
+    with ProcessPoolExecutor(max_workers=jobs,
+                             initializer=_initWorker,
+                             initargs=(timingEnabled(),
+                                       workerDiagnosticsConfig(),
+                                       fuzzyNames(),
+                                       phoneticNames())) as executor:
+        if shardSize:
+            shards = (shard for fileName in fileNames
+                      for shard in _fileShards(fileName, shardSize,
+                                               xlsOptions))
+            yield from _chunks(
+                _orderedMap(executor, processShard, shards, 4 * jobs))
+        else:
+            yield from _chunks(
+                _orderedMap(executor,
+                            partial(processFile, xlsOptions=xlsOptions),
+                            fileNames, 4 * jobs))
+
+
+#
+# Yield lists of output rows, in file and row order.
+#
+# With cacheDir, the output of each file is cached, and files that haven't
+# changed since the last run (with the same lexicon and normalizer code) are
+# not normalized again.
+#
+def processFiles(fileNames,
+                 jobs=1,
+                 shardSize=None,
+                 cacheDir=None,
+                 xlsOptions=None):
+    if not cacheDir:
+        for chunk in processChunks(fileNames, jobs, shardSize, xlsOptions):
+            yield chunk[3]
+        return
+
+    # Files are keyed by absolute path, as in the manifest, so a file named
+    # twice (maybe spelled differently) is only normalized once.
+    manifest = Manifest(cacheDir)
+    stale = {}
+    for fileName in fileNames:
+        key = os.path.abspath(fileName)
+        if key not in stale and not manifest.isCurrent(fileName):
+            stale[key] = fileName
+    fileCount = len({os.path.abspath(f) for f in fileNames})
+    info(
+        "Reusing cached output for {} of {} files".format(
+            fileCount - len(stale), fileCount), "cache")
+    chunks = processChunks(list(stale.values()), jobs, shardSize, xlsOptions)
+    chunk = next(chunks, None)
+    for fileName in fileNames:
+        if manifest.isCurrent(fileName):
+            setWarningContext(fileName, "")
+            with stage("load cached output"):
+                rows = manifest.rows(fileName)
+            setWarningContext("", "")
+            yield rows
+            continue
+        key = os.path.abspath(fileName)
+        fileType, records, rows = None, 0, []
+        consumed = False
+        while chunk and os.path.abspath(chunk[0]) == key:
+            consumed = True
+            fileType = fileType or chunk[1]
+            records += chunk[2]
+            rows.extend(chunk[3])
+            yield chunk[3]
+            chunk = next(chunks, None)
+        if consumed:
+            manifest.store(fileName, fileType, records, rows)
+    manifest.save()
@@ -0,0 +1,347 @@
+import random
+from itertools import accumulate
+
+from .namelist import nameList
+from .parsexls import _rowDict, getRowHeader
+
+#
+# Synthetic LitvakSIG records, for benchmarking the normalizer without the
+# real (unshareable) spreadsheets.
+#
+# Each synthetic "spreadsheet" picks one of the ways each column is labeled
+# in the real ones, and its header is run through getRowHeader, so the
+# records have the same keys as the ones xlsRows would produce for it.
+# The values are drawn from the name lexicon (with common names much more
+# common), and include the mess the normalizer has to deal with: ages and
+# names in comments, twins, witnesses, patronyms in given names,
+# Lithuanian/bracketed names, typos and bad ages.
+#
+
+# name lexicon entries by gender (each _Names shuffles them into its own
+# order of popularity)
+_names = {
+    gender: [(cooked, rawList) for cooked, g, rawList in nameList
+             if g == gender]
+    for gender in ("M", "F", "S")
+}
+
+_extraSurnames = (
+    "Kaplan",
+    "Levin",
+    "Fridman",
+    "Gordon",
+    "Kagan",
+    "Shapiro",
+    "Segal",
+    "Epshtein",
+    "Zak",
+    "Lipman",
+)
+_towns = (
+    ("Sejny", "Sejny", "Suwalki"),
+    ("Lazdijai", "Sejny", "Suwalki"),
+    ("Punsk", "Sejny", "Suwalki"),
+    ("Suwalki", "Suwalki", "Suwalki"),
+    ("Kalvarija", "Kalvarija", "Suwalki"),
+    ("Vilkaviskis", "Vilkaviskis", "Suwalki"),
+)
+_months = ("Jan", "February", "3", "Apr.", "5", "June", "(7)", "Aug", "9",
+           "Oct", "11", "Dec", "?", "")
+_occupations = ("tailor", "merchant", "shoemaker", "melamed", "butcher")
+_causes = ("fever", "old age", "consumption", "weakness", "typhus", "")
+
+
+class _Names:
+    def __init__(self, rng):
+        self.rng = rng
+        self.weights = {}
+        self.lists = {}
+        for gender, entries in _names.items():
+            entries = list(entries)
+            rng.shuffle(entries)
+            self.lists[gender] = entries
+            # Zipf-like: the n'th most common name is 1/n as common
+            self.weights[gender] = list(
+                accumulate(1 / (n + 1) for n in range(len(entries))))
+
+    def spelling(self, gender):
+        rng = self.rng
+        cooked, rawList = rng.choices(self.lists[gender],
+                                      cum_weights=self.weights[gender])[0]
+        if rawList and rng.random() < 0.8:
+            name = rng.choice(rawList)
+        else:
+            name = cooked.title()
+        if rng.random() < 0.03:
+            # typo: swap two letters
+            i = rng.randrange(1, max(2, len(name) - 1))
+            name = name[:i - 1] + name[i:i + 1] + name[i - 1:i] + name[i + 1:]
+        return name
+
+    def given(self, gender):
+        rng = self.rng
+        name = self.spelling(gender)
+        if rng.random() < 0.1:
+            name += " " + self.spelling(gender)  # double name: Chaia Leah
+        if rng.random() < 0.03:
+            name = "{}, {} of {}".format(name,
+                                         "son" if gender == "M" else "dau.",
+                                         self.spelling("M"))
+        return name
+
+    def surname(self):
+        rng = self.rng
+        if rng.random() < 0.3:
+            name = self.spelling("S")
+        else:
+            name = rng.choice(_extraSurnames)
+        if rng.random() < 0.03:
+            # Lithuanian form, with the transliteration in brackets
+            return "{}AS / [{}]".format(name.upper(), name.upper())
+        return name
+
+
+def _age(rng, low, high):
+    r = rng.random()
+    if r < 0.3:
+        return ""
+    if r < 0.93:
+        return str(rng.randint(low, high))
+    return rng.choice(
+        ("200", "?", "abt 40", "3 months", "1 1/2 years", "12 Mar 1810",
+         "newborn", "25 years"))
+
+
+# Columns: (key, labels, value), where key is the normalized column name,
+# labels are the ways the column is labeled (None: the column is missing),
+# and value(rng, names, record) makes a value for the record.
+
+_commonPre = (
+    ("record #", ("Record #", ), lambda rng, n, r: float(r["n"])),
+    ("year recorded", ("Year recorded", None),
+     lambda rng, n, r: float(r["year"])),
+    ("place recorded", ("Place recorded", ),
+     lambda rng, n, r: r["town"][0]),
+)
+_commonPost = (
+    ("d", ("Day", "D"), lambda rng, n, r: str(rng.randint(1, 28))),
+    ("m", ("Month", "M"), lambda rng, n, r: rng.choice(_months)),
+    ("y", ("Year", "Y"), lambda rng, n, r: float(r["year"])),
+    ("town", ("Town", ), lambda rng, n, r: r["town"][0]),
+    ("uyezd", ("District", "Uyezd"), lambda rng, n, r: r["town"][1]),
+    ("gubernia", ("Guberniya", "Gubernia"), lambda rng, n, r: r["town"][2]),
+    ("comments", ("Comments", ), lambda rng, n, r: r["comments"]),
+    ("source: archive / fond / list / item",
+     ("Source: Archive/Fond/List/Item",
+      "Source: Archive / Fond / List / Item"),
+     lambda rng, n, r: "LVIA/728/{}/{}".format(r["year"] % 7, r["n"] // 50)),
+    ("microfilm #", ("Microfilm #", ),
+     lambda rng, n, r: "{}".format(1920000 + r["n"] // 1000)),
+)
+
+
+def _witness(rng, names, record):
+    if rng.random() < 0.5:
+        return ""
+    parts = [names.given("M") + " " + names.surname()]
+    if rng.random() < 0.5:
+        parts.append(rng.choice(_occupations))
+    parts.append(str(rng.randint(20, 70)))
+    return ", ".join(parts)
+
+
+_witnesses = (
+    ("witness 1", ("Witness", "W1", "Witness 1", "Witness1", None), _witness),
+    ("witness 2", ("W2", "Witness 2", "Witness2", None), _witness),
+)
+
+
+def _childGiven(rng, names, record):
+    if rng.random() < 0.01:
+        return "Twins: {} and {}".format(names.spelling("M"),
+                                         names.spelling("F"))
+    return names.given(rng.choice("MF"))
+
+
+def _parentsComments(rng, names, record):
+    r = rng.random()
+    if r < 0.2:
+        return "father {}, mother {}".format(rng.randint(20, 50),
+                                             rng.randint(18, 45))
+    if r < 0.3:
+        return rng.choice(("illegitimate", "born in Suwalki", "see #12"))
+    return ""
+
+
+_birthColumns = (
+    *_commonPre,
+    ("child's surname", ("Child's surname", ),
+     lambda rng, n, r: r["surname"]),
+    ("child's given name", ("Child's given name", ), _childGiven),
+    ("father's given name", ("Father", "Father's given name"),
+     lambda rng, n, r: n.given("M")),
+    ("father's patronymic",
+     ("Paternal grandfather", "Father's father", "GF", "FF"),
+     lambda rng, n, r: n.spelling("M")),
+    ("mother's given name", ("Mother", "Mother's given name"),
+     lambda rng, n, r: n.given("F")),
+    ("mother's patronymic", ("Maternal grandfather", "Mother's father", "MF"),
+     lambda rng, n, r: n.spelling("M")),
+    ("mother's maiden name",
+     ("Mother's maiden name", "Mother's maiden surname"),
+     lambda rng, n, r: n.surname()),
+    ("father's age", ("Father's age", None),
+     lambda rng, n, r: _age(rng, 20, 55)),
+    ("mother's age", ("Mother's age", None),
+     lambda rng, n, r: _age(rng, 17, 45)),
+    *_commonPost,
+    *_witnesses,
+)
+
+
+def _deathComments(rng, names, record):
+    r = rng.random()
+    if r < 0.1:
+        return "widow"
+    if r < 0.2:
+        return "leaves wife, {}".format(rng.randint(20, 80))
+    if r < 0.25:
+        return "father, {}. mother {}".format(rng.randint(40, 90),
+                                              rng.randint(40, 90))
+    return ""
+
+
+_deathColumns = (
+    *_commonPre,
+    ("given name", ("Given name", ), lambda rng, n, r: n.given(r["gender"])),
+    ("surname", ("Surname", ), lambda rng, n, r: r["surname"]),
+    ("father's given name", ("Father", "Father's given name"),
+     lambda rng, n, r: n.given("M")),
+    ("father's patronymic", ("Paternal grandfather", None),
+     lambda rng, n, r: n.spelling("M")),
+    ("mother's given name", ("Mother", "Mother's given name"),
+     lambda rng, n, r: n.given("F")),
+    ("mother's patronymic", ("Maternal grandfather", None),
+     lambda rng, n, r: n.spelling("M")),
+    ("mother's maiden name", ("Mother's maiden name", ),
+     lambda rng, n, r: n.surname()),
+    ("spouse's given name", ("Spouse", "Spouse's given name"),
+     lambda rng, n, r: n.given("F" if r["gender"] == "M" else "M")
+     if rng.random() < 0.6 else ""),
+    ("spouse's surname", ("Spouse surname", "Spouse's surname"),
+     lambda rng, n, r: r["surname"] if rng.random() < 0.5 else ""),
+    ("age", ("Age", ), lambda rng, n, r: _age(rng, 0, 99)),
+    ("cause of death", ("Cause of death", ),
+     lambda rng, n, r: rng.choice(_causes)),
+    *_commonPost,
+    *_witnesses,
+)
+
+
+def _spouseColumns(side):
+    husband = side == "Husband"
+    gender = "M" if husband else "F"
+    prefix = "" if husband else "wife's "
+    # The wife's columns are either labeled explicitly, or have the same
+    # label as the husband's (which getRowHeader marks with a "*").
+    columns = (
+        ("given name", ("Husband's given name", "Given name"),
+         lambda rng, n, r: n.given(gender)),
+        ("surname", ("Husband's surname", "Surname"),
+         lambda rng, n, r: r["surname"] if husband else n.surname()),
+        ("father's given name",
+         ("Husband's father's given name", "Father's given name"),
+         lambda rng, n, r: n.given("M")),
+        ("father's patronymic",
+         ("Husband's paternal grandfather", "Paternal grandfather"),
+         lambda rng, n, r: n.spelling("M")),
+        ("mother's given name",
+         ("Husband's mother's given name", "Mother's given name"),
+         lambda rng, n, r: n.given("F")),
+        ("mother's patronymic",
+         ("Husband's maternal grandfather", "Maternal grandfather"),
+         lambda rng, n, r: n.spelling("M")),
+        ("mother's maiden name",
+         ("Husband's mother's maiden name", "Mother's maiden name"),
+         lambda rng, n, r: n.surname()),
+        ("age", ("Husband's age", "Age"),
+         lambda rng, n, r: _age(rng, 17, 60)),
+    )
+    if husband:
+        return (
+            *columns,
+            ("place", ("Husband's place", "Place", "Town, uyezd"),
+             lambda rng, n, r: rng.choice(_towns)[0]),
+        )
+    return (
+        *((prefix + key, ("Wife's " + key.capitalize(), labels[1] + "*"),
+           value) for key, labels, value in columns),
+        ("wife's place", ("Wife's place", ),
+         lambda rng, n, r: rng.choice(_towns)[0]),
+    )
+
+
+_marriageColumns = (
+    *_commonPre,
+    ("marriage or divorce", ("Marriage or divorce", ),
+     lambda rng, n, r: "Marriage" if rng.random() < 0.97 else "Divorce"),
+    *_spouseColumns("Husband"),
+    *_spouseColumns("Wife"),
+    *_commonPost,
+    *_witnesses,
+)
+
+_columns = {
+    "Birth": (_birthColumns, _parentsComments),
+    "Death": (_deathColumns, _deathComments),
+    "Marriage": (_marriageColumns, _parentsComments),
+}
+
+fileTypes = tuple(_columns)
+
+
+# Pick the labels of one synthetic spreadsheet's columns.
+def _pickLabels(rng, columns):
+    labels = []
+    for key, choices, value in columns:
+        label = rng.choice(choices)
+        if label and label.endswith("*"):
+            # same label as the husband's column, if we used that
+            label = label[:-1]
+            if label not in labels:
+                label = "Wife's " + key[len("wife's "):].capitalize()
+        if label:
+            labels.append(label)
+    return labels
+
+
+def syntheticHeader(fileType, rng, fileName):
+    columns, skip = _columns[fileType]
+    return getRowHeader(fileName, _pickLabels(rng, columns))
+
+
+#
+# Yield count synthetic records of fileType (Birth, Death or Marriage), as
+# xlsRows would.  Each rowsPerFile records come from a new synthetic
+# spreadsheet, with its own choice of column labels.
+#
+def syntheticRecords(fileType, count, seed=0, rowsPerFile=5000):
+    rng = random.Random(seed)
+    names = _Names(rng)
+    columns, comments = _columns[fileType]
+    byKey = {key: value for key, labels, value in columns}
+    header = None
+    for n in range(count):
+        if n % rowsPerFile == 0:
+            fileName = "Synthetic_{}_{}.xls".format(fileType, n // rowsPerFile)
+            header = syntheticHeader(fileType, rng, fileName)
+        record = {
+            "n": n % rowsPerFile + 1,
+            "year": rng.randint(1820, 1914),
+            "town": rng.choice(_towns),
+            "gender": rng.choice("MF"),
+            "surname": names.surname(),
+            "comments": comments(rng, names, None),
+        }
+        row = [byKey[key](rng, names, record) for key in header]
+        yield _rowDict(fileName, header, fileType, n % rowsPerFile + 3, row)
@@ -0,0 +1,51 @@
+import threading
+import time
+from urllib.parse import urlsplit
+
+#
+# Politeness, for downloading from a site with several threads: a token
+# bucket to limit the rate of requests, and a limit on the number of
+# transfers in progress to each host.
+#
+
+
+class TokenBucket:
+    # rate tokens a second, up to burst saved up
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Wait for a token, and take it.
+    def take(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst,
+                                  self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class HostLimits:
+    def __init__(self, perHost):
+        self.perHost = perHost
+        self.semaphores = {}
+        self.lock = threading.Lock()
+
+    # A context manager that holds one of the host's slots:
+    #   with limits.slot(url): ...
+    def slot(self, url):
+        host = urlsplit(url).netloc
+        with self.lock:
+            semaphore = self.semaphores.get(host)
+            if semaphore is None:
+                semaphore = self.semaphores[host] = threading.BoundedSemaphore(
+                    self.perHost)
+        return semaphore
@@ -0,0 +1,160 @@
+import os
+import random
+import sys
+from functools import wraps
+from time import perf_counter
+
+from .utils import warningContext
+
+#
+# Lightweight stage timers, for finding out where a run spends its time.
+#
+# Functions are decorated with @timed(stage), or code is wrapped in
+# "with stage(name):".  Until enableTiming() is called they cost a flag check.
+# Times are inclusive: a stage's time includes the stages nested in it.
+#
+# Stats are kept per (stage, file), where file is the spreadsheet being
+# processed (from the warning context).  Each has a call count, a total
+# time, and a bounded random sample of call times for the percentiles.
+#
+# There are also cache hit/miss counts, from countCache().
+#
+
+SAMPLE_SIZE = 1000
+
+_enabled = False
+_stats = {}
+_caches = {}  # name: [hits, misses]
+_random = random.Random(0)
+
+
+def enableTiming(enabled=True):
+    global _enabled
+    _enabled = enabled
+
+
+def timingEnabled():
+    return _enabled
+
+
+def _record(name, elapsed):
+    key = (name, os.path.basename(warningContext()[0]))
+    stats = _stats.get(key)
+    if not stats:
+        _stats[key] = [1, elapsed, [elapsed]]
+        return
+    stats[0] += 1
+    stats[1] += elapsed
+    sample = stats[2]
+    if len(sample) < SAMPLE_SIZE:
+        sample.append(elapsed)
+    else:
+        # reservoir sampling: every call is equally likely to be sampled
+        i = _random.randrange(stats[0])
+        if i < SAMPLE_SIZE:
+            sample[i] = elapsed
+
+
+def timed(name):
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            start = perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _record(name, perf_counter() - start)
+
+        return wrapper
+
+    return decorate
+
+
+class stage:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        if _enabled:
+            self.start = perf_counter()
+
+    def __exit__(self, *exc):
+        if _enabled:
+            _record(self.name, perf_counter() - self.start)
+
+
+def countCache(name, hit):
+    if _enabled:
+        counts = _caches.setdefault(name, [0, 0])
+        counts[0 if hit else 1] += 1
+
+
+# Return the stats collected so far (e.g. in a worker process), and reset.
+def drainTimings():
+    global _stats, _caches
+    stats, _stats = _stats, {}
+    caches, _caches = _caches, {}
+    return stats, caches
+
+
+def mergeTimings(timings):
+    stats, caches = timings
+    for name, (hits, misses) in caches.items():
+        counts = _caches.setdefault(name, [0, 0])
+        counts[0] += hits
+        counts[1] += misses
+    for key, (count, total, sample) in stats.items():
+        mine = _stats.setdefault(key, [0, 0, []])
+        mine[0] += count
+        mine[1] += total
+        mine[2].extend(sample)
+        if len(mine[2]) > SAMPLE_SIZE:
+            mine[2] = _random.sample(mine[2], SAMPLE_SIZE)
+
+
+def _percentile(sample, p):
+    sample = sorted(sample)
+    return sample[min(len(sample) - 1, int(len(sample) * p))]
+
+
+def _formatTable(title, rows, out):
+    print(title, file=out)
+    print("  {:28s} {:>9s} {:>10s} {:>10s} {:>10s}".format(
+        "Stage", "Calls", "Total s", "Mean ms", "p99 ms"),
+          file=out)
+    for name, (count, total, sample) in rows:
+        print("  {:28s} {:9d} {:10.3f} {:10.4f} {:10.4f}".format(
+            name[:28], count, total, total / count * 1000,
+            _percentile(sample, 0.99) * 1000),
+              file=out)
+
+
+def reportTimings(out=sys.stderr):
+    byStage = {}
+    byFile = {}
+    for (name, fileName), stats in sorted(_stats.items()):
+        merged = byStage.setdefault(name, [0, 0, []])
+        merged[0] += stats[0]
+        merged[1] += stats[1]
+        merged[2] += stats[2]
+        byFile.setdefault(fileName or "-", []).append((name, stats))
+
+    def totalTime(item):
+        return -item[1][1]
+
+    _formatTable("TIMINGS BY STAGE", sorted(byStage.items(), key=totalTime),
+                 out)
+    for fileName, rows in byFile.items():
+        _formatTable("TIMINGS FOR " + fileName, sorted(rows, key=totalTime),
+                     out)
+    if _caches:
+        print("CACHES", file=out)
+        print("  {:28s} {:>9s} {:>10s} {:>10s}".format(
+            "Cache", "Hits", "Misses", "Hit %"),
+              file=out)
+        for name, (hits, misses) in sorted(_caches.items()):
+            print("  {:28s} {:9d} {:10d} {:10.1f}".format(
+                name[:28], hits, misses, hits * 100 / (hits + misses)),
+                  file=out)
@@ -1,10 +1,19 @@
-import requests
+import atexit
+import hashlib
+import json
+import os
 import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+from .throttle import HostLimits, TokenBucket
 
 _session = None
 _userId = None
 
-BASE_URL = "https://donors.litvaksig.org/"
+# LITVAK_BASE_URL can point the scripts at another server, e.g. for testing
+BASE_URL = os.getenv("LITVAK_BASE_URL", "https://donors.litvaksig.org/")
 
 
 def _check_response(response, **kwargs):
@@ -27,28 +36,293 @@ def setWarningContext(fileName, row):
     _curRow = row
 
 
-def info(msg):
-    print("{}:{} INFO: {}".format(_curFileName, _curRow, msg), file=sys.stderr)
+def warningContext():
+    return _curFileName, _curRow
 
 
-def warning(msg):
-    global _curFileName, _curRow
-    print("{}:{} WARNING: {}".format(_curFileName, _curRow, msg),
-          file=sys.stderr)
+#
+# Diagnostics: messages about the input, with a level and a category.
+#
+# Messages go to stderr through a buffer, which is written out when it holds
+# _BUFFER_LINES messages, or _BUFFER_SECONDS after the first message in it
+# (by a timer thread), so progress messages are never held back for long.
+# Messages to a terminal aren't buffered.  Each category shows at most
+# maxPerCategory messages, and the number suppressed beyond that is reported
+# by finishDiagnostics().  Optionally, every message (at the chosen level or
+# above) is also written to a JSON Lines file, with file, row, level,
+# category and message fields.
+#
+# In pool worker processes, messages are collected instead, and sent back
+# to the main process to be reported there (see drainDiagnostics).
+#
+LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR")
+_WARNING = LEVELS.index("WARNING")
+
+_BUFFER_LINES = 1000
+_BUFFER_SECONDS = 1
+
+_minLevel = LEVELS.index("INFO")
+_maxPerCategory = None
+_jsonl = None
+_collecting = False
+_keepAll = False
+_buffer = []
+_collected = []
+_inherited = []
+_recordErrors = None
+_lock = threading.RLock()  # for messages from download threads
+_flushTimer = None
+_shown = Counter()
+_counts = Counter()  # by (level, category)
+
+
+#
+# With collect (in a worker process), messages are kept for the main process,
+# and keepAll says whether it wants all of them (for its JSON Lines file).
+#
+def configureDiagnostics(level="INFO",
+                         maxPerCategory=None,
+                         jsonlFileName=None,
+                         collect=False,
+                         keepAll=False):
+    global _minLevel, _maxPerCategory, _jsonl, _collecting, _keepAll
+    if collect:
+        # A forked worker inherits the main process's buffer and JSON Lines
+        # file, which are not its to write.  The file is set aside, not
+        # closed: closing it would write out the main process's buffered
+        # lines again.
+        _inherited.append(_jsonl)
+        _jsonl = None
+    else:
+        flushDiagnostics()
+        if _jsonl:
+            _jsonl.close()
+        _jsonl = open(jsonlFileName, "w") if jsonlFileName else None
+    _minLevel = LEVELS.index(level)
+    _maxPerCategory = maxPerCategory or None
+    _collecting = collect
+    _keepAll = keepAll
+    _buffer.clear()
+    _collected.clear()
+    _shown.clear()
+    _counts.clear()
+
+
+# The configuration for collecting diagnostics in a worker process.
+def workerDiagnosticsConfig():
+    return {
+        "level": LEVELS[_minLevel],
+        "maxPerCategory": _maxPerCategory,
+        "collect": True,
+        "keepAll": _jsonl is not None,
+    }
+
+
+#
+# Warnings raised while a record is processed are also collected for the
+# record's Errors field, whatever is shown.
+#
+def startRecordErrors():
+    global _recordErrors
+    _recordErrors = []
+
+
+def endRecordErrors():
+    global _recordErrors
+    errors, _recordErrors = _recordErrors, None
+    return "; ".join(dict.fromkeys(errors))
+
+
+def diagnostic(level, msg, category=None, fileName=None, row=None):
+    levelNum = LEVELS.index(level)
+    if _recordErrors is not None and levelNum >= _WARNING:
+        _recordErrors.append(msg)
+    if levelNum < _minLevel:
+        return
+    category = category or level.lower()
+    if fileName is None:
+        fileName, row = _curFileName, _curRow
+    with _lock:
+        _counts[level, category] += 1
+        if _collecting:
+            # only keep what the main process could show
+            if (_keepAll or not _maxPerCategory
+                    or _counts[level, category] <= _maxPerCategory):
+                _collected.append((level, category, fileName, row, msg))
+            return
+        if _jsonl:
+            _jsonl.write(
+                json.dumps({
+                    "file": fileName,
+                    "row": row,
+                    "level": level,
+                    "category": category,
+                    "message": msg,
+                }) + "\n")
+        if _maxPerCategory and _shown[category] >= _maxPerCategory:
+            return
+        _shown[category] += 1
+        _buffer.append("{}:{} {}: {}\n".format(fileName, row, level, msg))
+        if len(_buffer) >= _BUFFER_LINES or _isTerminal(sys.stderr):
+            flushDiagnostics()
+        else:
+            _startFlushTimer()
+
+
+def _isTerminal(f):
+    try:
+        return f.isatty()
+    except (AttributeError, ValueError):
+        return False
+
+
+def _startFlushTimer():
+    global _flushTimer
+    if _flushTimer is None:
+        _flushTimer = threading.Timer(_BUFFER_SECONDS, flushDiagnostics)
+        _flushTimer.daemon = True
+        _flushTimer.start()
+
+
+def debug(msg, category=None):
+    diagnostic("DEBUG", msg, category)
+
+
+def info(msg, category=None):
+    diagnostic("INFO", msg, category)
+
+
+def warning(msg, category=None):
+    diagnostic("WARNING", msg, category)
+
+
+# A forked worker process doesn't get the timer thread, and mustn't inherit
+# a lock it held.
+def _afterFork():
+    global _lock, _flushTimer
+    _lock = threading.RLock()
+    _flushTimer = None
+
+
+os.register_at_fork(after_in_child=_afterFork)
+
+
+def flushDiagnostics():
+    global _flushTimer
+    with _lock:
+        if _flushTimer is not None:
+            _flushTimer.cancel()
+            _flushTimer = None
+        if _buffer:
+            sys.stderr.write("".join(_buffer))
+            _buffer.clear()
+        sys.stderr.flush()
+        if _jsonl:
+            _jsonl.flush()
+
+
+# The messages collected in a worker process (and their counts), for
+# replayDiagnostics in the main process.
+def drainDiagnostics():
+    collected = list(_collected)
+    counts = dict(_counts)
+    _collected.clear()
+    _counts.clear()
+    return collected, counts
+
+
+def replayDiagnostics(diagnostics):
+    collected, counts = diagnostics
+    for level, category, fileName, row, msg in collected:
+        diagnostic(level, msg, category, fileName, row)
+    # messages the worker didn't keep are still counted
+    kept = Counter((level, category) for level, category, *skip in collected)
+    with _lock:
+        for key, count in counts.items():
+            _counts[key] += count - kept[key]
+
+
+def diagnosticCounts():
+    return dict(_counts)
+
+
+# Flush, and report how many messages of each category were suppressed.
+def finishDiagnostics():
+    with _lock:
+        if _maxPerCategory:
+            byCategory = Counter()
+            for (level, category), count in _counts.items():
+                byCategory[category] += count
+            for category, count in sorted(byCategory.items()):
+                if count > _shown[category]:
+                    _buffer.append(
+                        "INFO: {} more '{}' messages suppressed ({} in all)\n"
+                        .format(count - _shown[category], category, count))
+        flushDiagnostics()
 
 
 def fatal(msg):
+    flushDiagnostics()
     print("ERROR: " + msg, file=sys.stderr)
     sys.exit(1)
 
 
+atexit.register(flushDiagnostics)
+
+
+def fileHash(fileName):
+    h = hashlib.sha256()
+    with open(fileName, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# Write a file so that readers (or other processes) never see a partial one.
+def writeFileAtomic(fileName, data):
+    tmpName = "{}.{}.tmp".format(fileName, os.getpid())
+    with open(tmpName, "wb") as f:
+        f.write(data)
+    os.replace(tmpName, fileName)
+
+
+#
+# Requests can be made from several threads, sharing the session's pool of
+# connections.  To be polite, there can be a limit on the rate of requests
+# (a token bucket), and on the number of requests (or downloads) in progress
+# to a host at a time.
+#
+POOL_SIZE = 10
+
+_poolSize = POOL_SIZE
+_bucket = None
+_hostLimits = None
+
+
+def configureRequests(threads=1, perHost=None, rate=None, burst=1):
+    global _poolSize, _bucket, _hostLimits
+    _poolSize = max(POOL_SIZE, threads)
+    _bucket = TokenBucket(rate, burst) if rate else None
+    _hostLimits = HostLimits(perHost) if perHost else None
+
+
+def _hostSlot(fullUrl):
+    return _hostLimits.slot(fullUrl) if _hostLimits else nullcontext()
+
+
 def login(username, password):
     global _session
     global _userId
     if _userId:
         return  # already logged in
 
+    # imported here, so scripts that don't download don't pay for it
+    import requests
+
     _session = requests.session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=_poolSize)
+    _session.mount("https://", adapter)
+    _session.mount("http://", adapter)
     headers = {
         "User-Agent":
         "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1)"
@@ -71,8 +345,32 @@ def login(username, password):
     info("Login complete: {}".format(response.url))
 
 
-def get(url, baseUrl=BASE_URL, **kwargs):
+def _request(method, url, baseUrl=BASE_URL, **kwargs):
     global _session
     if not _session:
         login()
-    return _session.get(baseUrl + url, **kwargs)
+    if _bucket:
+        _bucket.take()
+    return _session.request(method, baseUrl + url, **kwargs)
+
+
+def get(url, baseUrl=BASE_URL, **kwargs):
+    with _hostSlot(baseUrl + url):
+        return _request("GET", url, baseUrl, **kwargs)
+
+
+def head(url, baseUrl=BASE_URL, **kwargs):
+    with _hostSlot(baseUrl + url):
+        return _request("HEAD", url, baseUrl, **kwargs)
+
+
+# A streamed response, holding a slot of its host until it is read:
+#   with getStream(url) as response: ...
+@contextmanager
+def getStream(url, baseUrl=BASE_URL, **kwargs):
+    with _hostSlot(baseUrl + url):
+        response = _request("GET", url, baseUrl, stream=True, **kwargs)
+        try:
+            yield response
+        finally:
+            response.close()